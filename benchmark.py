@@ -0,0 +1,384 @@
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from gensim.models import Word2Vec
+
+from dictionary import Dictionary, UrbanDict
+from helpers import peak_memory, read_comments, read_comments_json, create_batches, create_stream_from_files, batch_sentences
+from model import Model
+from similarity import VectorIndex, benchmark_ann
+from windowstore import WindowStore
+from textprocessor import TextProcessor
+
+def generate_words(number, random_generator):
+    """
+    number: number of words
+    random_generator: instance of random.Random
+
+    return: list of distinct lowercase words
+    """
+    words = set()
+    while len(words) < number:
+        length = random_generator.randint(3, 9)
+        words.add(''.join(random_generator.choice(string.ascii_lowercase)
+                          for _ in range(length)))
+    return sorted(words)
+
+def generate_comments(fle, number, known_words, slang_words, seed=1,
+                      start=1421280000, seconds_between=10):
+    """
+    fle: path of the output file
+    number: number of comments
+    known_words: list of words that will be in the dictionary
+    slang_words: list of words that will not be in the dictionary
+    seed: seed of the random generator
+    start: created_utc of the first comment
+    seconds_between: seconds between two comments
+
+    Writes comments in the format of the dataset, a json object with a body and
+    created_utc on every line. Words are drawn from a Zipf-like distribution,
+    with some punctuation, numbers, urls and bot comments mixed in.
+    """
+    random_generator = random.Random(seed)
+    words = known_words + slang_words
+    random_generator.shuffle(words)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    extras = [',', '.', '!', '42', 'http://example.com/x', "don't", '-', '(yes)']
+
+    with open(fle, 'w') as outpt:
+        for number_comment in range(number):
+            length = random_generator.randint(5, 60)
+            body = random_generator.choices(words, weights=weights, k=length)
+            for _ in range(length // 10):
+                body.insert(random_generator.randrange(len(body)),
+                            random_generator.choice(extras))
+            body = ' '.join(body).capitalize()
+            if number_comment % 500 == 0:
+                body += ' *[I am a bot]'
+            outpt.write(json.dumps({'body': body,
+                                    'created_utc': start + number_comment * seconds_between}) + '\n')
+
+class Benchmark:
+    """
+    Runs stages and collects their results.
+    """
+    def __init__(self, trace_memory=False):
+        """
+        trace_memory: also measure the peak of memory allocated by Python with
+                      tracemalloc. Makes stages a lot slower.
+        """
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def measure(self, stage, size, function, items=None):
+        """
+        stage: name of the stage
+        size: number of comments of the data set
+        function: function running the stage. Its return value is returned.
+        items: number of items processed by the stage, for the throughput. If
+               None, the length of the return value is used.
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        output = function()
+        seconds = time.perf_counter() - start
+
+        result = {'stage': stage, 'size': size, 'seconds': seconds,
+                  'peak_rss_mb': peak_memory()}
+        if self.trace_memory:
+            result['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+
+        if items is None and hasattr(output, '__len__'):
+            items = len(output)
+        if items is not None:
+            result['items'] = items
+            result['per_second'] = items / seconds if seconds > 0 else None
+
+        self.results.append(result)
+        print('{:>8} {:<28} {:>9.3f}s {:>12} items/s {:>8.0f} MB'.format(
+            size, stage, seconds,
+            '-' if result.get('per_second') is None else '{:.0f}'.format(result['per_second']),
+            result['peak_rss_mb']))
+        return output
+
+def run(sizes, directory, trace_memory=False, min_count=5):
+    """
+    sizes: list of numbers of comments
+    directory: folder for the generated data
+    trace_memory: see Benchmark
+    min_count: min_count of the Word2Vec model
+
+    return: list of results of all stages for all sizes
+    """
+    random_generator = random.Random(0)
+    words = generate_words(6000, random_generator)
+    known_words, slang_words = words[:5000], words[5000:]
+
+    textprocessor = TextProcessor()
+    fast_textprocessor = TextProcessor(fast=True)
+    dictionary = Dictionary()
+    for word in known_words:
+        word = textprocessor.clean_text(word)
+        if len(word) > 0:
+            dictionary.add_word(word[0])
+
+    benchmark = Benchmark(trace_memory=trace_memory)
+    for size in sizes:
+        fle = os.path.join(directory, 'comments-{}.txt'.format(size))
+        generate_comments(fle, size, known_words, slang_words)
+
+        # The same comments, parsed line by line and with the chunked regex
+        # reader, to compare their comments per second
+        benchmark.measure('json parsing', size, lambda: list(read_comments_json(fle)))
+        comments = benchmark.measure('regex parsing', size,
+                                     lambda: list(read_comments(fle)))
+        bodies = [body for _, body in comments]
+
+        cleaned = benchmark.measure('clean_text', size,
+                                    lambda: [textprocessor.clean_text(body) for body in bodies])
+        benchmark.measure('clean_text fast', size,
+                          lambda: [fast_textprocessor.clean_text(body) for body in bodies])
+
+        tokens = sum(len(words) for words in cleaned)
+        batches = list(create_batches(((created_utc, words) for (created_utc, _), words
+                                       in zip(comments, cleaned)),
+                                      time_delta=1, minimum_words=5))
+        sentences = [sentence for batch in batches for sentence in batch_sentences(batch)]
+
+        # Batches of words compared to batches of token ids, as kept in the
+        # window, and the cost of converting them back to words for gensim
+        for as_ids in (False, True):
+            stage = 'batches token ids' if as_ids else 'batches words'
+            stream_batches = benchmark.measure(stage, size,
+                                               lambda: list(create_stream_from_files([fle], fast_textprocessor,
+                                                                                     time_delta=1, minimum_words=5,
+                                                                                     as_ids=as_ids)),
+                                               items=size)
+            benchmark.results[-1]['batches_mb'] = batches_memory(stream_batches)
+            benchmark.measure(stage + ' to sentences', size,
+                              lambda: [batch_sentences(batch, dictionary) for batch in stream_batches],
+                              items=len(stream_batches))
+
+        # The batches of the window as json files, like ../Database used to
+        # be, compared to the window store
+        json_directory = os.path.join(directory, 'database-{}'.format(size))
+        os.makedirs(json_directory)
+        benchmark.measure('database json write', size,
+                          lambda: [write_json_batch(json_directory, batch) for batch in batches],
+                          items=len(batches))
+        benchmark.results[-1]['disk_mb'] = directory_size(json_directory)
+        benchmark.measure('database json load', size,
+                          lambda: [load_json_batch(json_directory, batch['date']) for batch in batches],
+                          items=len(batches))
+
+        store = WindowStore(os.path.join(directory, 'window-{}'.format(size)))
+        benchmark.measure('window store write', size,
+                          lambda: [store.append(batch['date'], batch['comments']) for batch in batches],
+                          items=len(batches))
+        benchmark.results[-1]['disk_mb'] = directory_size(store.directory)
+        benchmark.measure('window store load', size,
+                          lambda: [len(batch['comments']) for batch in store.batches()],
+                          items=len(batches))
+
+        model = benchmark.measure('build_vocab', size, lambda: build_vocab(sentences, min_count),
+                                  items=tokens)
+        benchmark.measure('train', size, lambda: model.train(sentences), items=tokens)
+
+        unknown = benchmark.measure('unknown_words', size,
+                                    lambda: model.unknown_words(dictionary, min_occurence=min_count))
+
+        urban = UrbanDict()
+        benchmark.measure('fill_dict per word', size,
+                          lambda: urban.fill_dict(model, unknown, topn=1000, treshold=0.3),
+                          items=len(unknown))
+        benchmark.measure('filter_on_dict', size, lambda: urban.filter_on_dict(dictionary),
+                          items=len(unknown))
+
+        indexed_urban = UrbanDict()
+        benchmark.measure('fill_dict indexed', size,
+                          lambda: indexed_urban.fill_dict(model, unknown, topn=1000, treshold=0.3,
+                                                          index=VectorIndex(model, candidates=dictionary.words)),
+                          items=len(unknown))
+
+        # Recall and speed of the approximate index compared to the exact one
+        if len(unknown) > 0:
+            for result in benchmark_ann(model, unknown, candidates=dictionary.words):
+                result.update({'stage': 'ann {} tables {} bits'.format(result['tables'], result['bits']),
+                               'size': size, 'seconds': result['approximate_seconds']})
+                benchmark.results.append(result)
+
+        # End-to-end initialization on the same file, batch by batch and in
+        # parallel
+        benchmark.measure('initialize', size,
+                          lambda: Model().initialize(create_stream_from_files([fle], textprocessor, time_delta=1,
+                                                                              minimum_words=5),
+                                                     min_count=min_count, iterations=len(batches)),
+                          items=size)
+        benchmark.measure('initialize_parallel', size,
+                          lambda: Model().initialize_parallel([fle], textprocessor, min_count=min_count,
+                                                              time_delta=1, minimum_words=5),
+                          items=size)
+
+    return benchmark.results
+
+# Entry points measured by cold_start, as run with python -c. The paths are
+# filled in by cold_start.
+ENTRY_POINTS = [
+    ('python', 'pass'),
+    ('import textprocessor', 'import textprocessor'),
+    ('import model', 'import model'),
+    ('import pipeline', 'import pipeline'),
+    ('TextProcessor', 'from textprocessor import TextProcessor; TextProcessor(fast=True)'),
+    ('dictionary prebuilt', 'from dictionary import Dictionary; from textprocessor import TextProcessor; '
+                            'Dictionary().fill_dict_from_txt({words!r}, TextProcessor(fast=True), '
+                            'prebuilt={dictionary!r})'),
+    ('clean_text', 'from textprocessor import TextProcessor; '
+                   'TextProcessor(fast=True).clean_text({comment!r})'),
+    ('clean_text prebuilt lemmas', 'from textprocessor import TextProcessor; tp = TextProcessor(fast=True); '
+                                   'tp.load_lemmas({lemmas!r}); tp.clean_text({comment!r})'),
+]
+
+def cold_start(directory, repeat=5):
+    """
+    directory: folder for the generated data and prebuilt files
+    repeat: number of times every entry point is started
+
+    return: list of results, with the median seconds of starting a new
+            interpreter and running the entry point
+
+    Measures the startup of short one-off runs, e.g. a single lookup, which
+    pay for importing nltk and gensim and loading WordNet and the dictionary.
+    """
+    random_generator = random.Random(0)
+    words = generate_words(6000, random_generator)
+    known_words, slang_words = words[:5000], words[5000:]
+
+    words_file = os.path.join(directory, 'words.txt')
+    with open(words_file, 'w') as outpt:
+        outpt.write('\n'.join(known_words) + '\n')
+    comments_file = os.path.join(directory, 'cold-start.txt')
+    generate_comments(comments_file, 1000, known_words, slang_words)
+    bodies = [body for _, body in read_comments(comments_file)]
+
+    # The prebuilt files, as made by the first run of the pipeline
+    textprocessor = TextProcessor(fast=True)
+    files = {'words': words_file,
+             'dictionary': os.path.join(directory, 'words.prebuilt'),
+             'lemmas': os.path.join(directory, 'lemmas.prebuilt'),
+             'comment': bodies[1]}
+    Dictionary().fill_dict_from_txt(words_file, textprocessor, prebuilt=files['dictionary'])
+    textprocessor.save_lemmas(files['lemmas'], {word for body in bodies
+                                                for word in textprocessor.fast_tokenize(body)})
+
+    results = []
+    for stage, code in ENTRY_POINTS:
+        command = [sys.executable, '-c', code.format(**files)]
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            seconds.append(time.perf_counter() - start)
+        seconds.sort()
+        result = {'stage': 'cold start ' + stage, 'size': None,
+                  'seconds': seconds[len(seconds) // 2], 'min_seconds': seconds[0]}
+        results.append(result)
+        print('{:>8} {:<38} {:>9.3f}s {:>9.3f}s min'.format('-', result['stage'], result['seconds'],
+                                                          result['min_seconds']))
+    return results
+
+def batches_memory(batches):
+    """
+    batches: list of batches of words or token ids
+
+    return: number of MB used by the batches, without the strings of the words
+            that are shared with the vocabulary of the model
+    """
+    size = 0
+    for batch in batches:
+        if 'ids' in batch:
+            size += sys.getsizeof(batch['ids']) + sys.getsizeof(batch['offsets'])
+        else:
+            size += sys.getsizeof(batch['comments'])
+            size += sum(sys.getsizeof(comment) for comment in batch['comments'])
+    return size / 1024 ** 2
+
+def write_json_batch(directory, batch):
+    with open(os.path.join(directory, batch['date'] + '.json'), 'w') as outpt:
+        json.dump({'date': batch['date'], 'comments': batch['comments']}, outpt)
+
+def load_json_batch(directory, date):
+    with open(os.path.join(directory, date + '.json'), 'r') as inpt:
+        return json.load(inpt)
+
+def directory_size(directory):
+    """
+    return: number of MB of all files in the folder
+    """
+    return sum(os.path.getsize(os.path.join(directory, fle))
+               for fle in os.listdir(directory)) / 1024 ** 2
+
+def build_vocab(sentences, min_count):
+    """
+    sentences: list of comments. Comment being a list of words.
+    min_count: min_count of the Word2Vec model
+
+    return: instance of Model with only its vocabulary built, like
+            Model.initialize does for the first batch
+    """
+    model = Model()
+    model.model = Word2Vec(min_count=min_count, workers=2)
+    model.build_vocab(sentences)
+    return model
+
+def current_commit():
+    """
+    return: hash of the current git commit, or None
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    # The results of every stage (seconds, items per second and peak memory)
+    # are printed and written as json, so runs of different commits can be
+    # compared.
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the pipeline '
+                                                 'on synthetic Reddit comments')
+    parser.add_argument('--sizes', default='1000,10000,50000',
+                        help='comma separated numbers of comments')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='json file to write the results to')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure peak Python allocations with tracemalloc (slow)')
+    parser.add_argument('--cold-start-repeat', type=int, default=5,
+                        help='number of starts of every python -c entry point, 0 to skip them')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run([int(size) for size in args.sizes.split(',')], directory,
+                      trace_memory=args.trace_memory)
+        if args.cold_start_repeat > 0:
+            results += cold_start(directory, repeat=args.cold_start_repeat)
+
+    with open(args.output, 'w') as outpt:
+        json.dump({'commit': current_commit(),
+                   'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'results': results}, outpt, indent='\t')
+    print('results written to {}'.format(args.output))
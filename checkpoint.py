@@ -0,0 +1,61 @@
+import json
+import os
+
+# Version of the checkpoint format
+VERSION = 1
+
+def checkpoint_state(window, batch, model_dir):
+    """
+    window: instance of the class SlidingWindow, after the step on the batch
+    batch: the last batch of the stream the window was trained on
+    model_dir: folder the model of the window is saved in for this batch
+
+    return: dict that can be written with write_checkpoint
+
+    The batches of the window are not stored in the checkpoint itself, they
+    are read again from the WindowStore of the pipeline by their date.
+    """
+    return {'version': VERSION,
+            'date': str(batch['date']),
+            'model': model_dir,
+            'window': [str(past_batch['date']) for past_batch in window.batches],
+            'steps_since_rebuild': window.steps_since_rebuild,
+            'position': batch.get('position')}
+
+def write_checkpoint(path, state, wait_for=()):
+    """
+    path: path of the checkpoint file
+    state: dict made by checkpoint_state
+    wait_for: futures of the writes the checkpoint refers to, e.g. of the
+              model save. If one of them failed, the checkpoint is not
+              written and the error is raised.
+
+    Writes the checkpoint atomically, so a crash during the write leaves the
+    previous checkpoint intact.
+    """
+    for future in wait_for:
+        future.result()
+
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    with open(path + '.tmp', 'w') as outpt:
+        json.dump(state, outpt, indent='\t')
+        outpt.flush()
+        os.fsync(outpt.fileno())
+    os.replace(path + '.tmp', path)
+
+def load_checkpoint(path):
+    """
+    path: path of the checkpoint file
+
+    return: dict made by checkpoint_state, or None if there is no checkpoint
+            or it was written by another version
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as inpt:
+        state = json.load(inpt)
+    if state.get('version') != VERSION:
+        return None
+    return state
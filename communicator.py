@@ -1,5 +1,8 @@
 import praw
 
+import helpers
+import ingest
+
 class Communicator:
     """
     Basic class to communicate with the Reddit API
@@ -21,7 +24,8 @@ class Communicator:
                                 user_agent=self.user_agent)
 
     def stream_comments(self, textprocessor, subreddit='all', batch_size=1000,
-                              minimum_words=20):
+                              minimum_words=20, workers=1, chunk_size=50,
+                              sketch=None):
         """
         textprocessor: an instance of the class TextProcessor.
         subreddit: which subreddit to use. Only one subreddit per stream possible.
@@ -35,22 +39,62 @@ class Communicator:
             https://pythontips.com/2013/09/29/the-python-yield-keyword-explained/
         minimum_words: minimum words in a comment after preprocessing before this
                        comment is actually added to the batch
+        workers: number of processes used for cleaning the comments. With more
+                 than one worker, comments are cleaned in chunks of chunk_size
+                 comments by a process pool. The order of the comments stays
+                 the same.
+        chunk_size: number of comments send to a process at once. Keep it
+                    small, a chunk is only cleaned when it is complete.
+        sketch: instance of sketch.SlangSketch, every batch is added to it
+                before it is yielded
 
         yield: list of comments. Comments being a list of words.
         """
         # Connect to the subreddits comment stream, yields comments
         stream = self.auth.subreddit(subreddit).stream.comments()
+        stream = ((comment.created_utc, comment.body) for comment in stream)
+        pool = helpers.create_pool(textprocessor, workers)
         batch = []
 
-        # Iterate over yielded comments
-        for comment in stream:
+        try:
+            # Iterate over cleaned comments
+            for _, text in helpers.clean_comments(stream, textprocessor,
+                                                  pool=pool,
+                                                  chunk_size=chunk_size):
+
+                # Add comment text to batch if required number of words
+                if len(text) >= minimum_words:
+                    batch.append(text)
 
-            # Extract text from comment, add to batch if required number of words
-            text = textprocessor.clean_text(comment.body)
-            if len(text) >= minimum_words:
-                batch.append(text)
+                # Yield and empty batch if number of comments exceeds batch_size
+                if len(batch) >= batch_size:
+                    if sketch is not None:
+                        sketch.add_comments(batch)
+                    yield batch
+                    batch = []
+        finally:
+            if pool is not None:
+                pool.terminate()
 
-            # Yield and empty batch if number of comments exceeds batch_size
-            if len(batch) >= batch_size:
-                yield batch
-                batch = []
+    def stream_batches(self, textprocessor, subreddit='all', time_delta=12,
+                       minimum_words=20, workers=1, metrics=None):
+        """
+        textprocessor: an instance of the class TextProcessor.
+        subreddit: which subreddit to use, see stream_comments
+        time_delta: number of hours of comments in one batch
+        minimum_words: minimum words in a comment after preprocessing before
+                       this comment is actually added to the batch
+        workers: number of processes used for cleaning the comments
+        metrics: instance of ingest.IngestMetrics to count the comments in
+
+        yield: dict with the date of the batch and a list of comments, the
+               same as helpers.create_stream_from_files
+
+        Fetching, cleaning and batching are done concurrently with asyncio,
+        see ingest.stream_batches.
+        """
+        source = ingest.RedditSource(self, subreddit=subreddit)
+        return ingest.stream_batches(source, textprocessor,
+                                     time_delta=time_delta,
+                                     minimum_words=minimum_words,
+                                     workers=workers, metrics=metrics)
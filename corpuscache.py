@@ -0,0 +1,258 @@
+from array import array
+import hashlib
+from itertools import islice
+import mmap
+import os
+import struct
+
+# Header of a cache file: magic, format version, size and modification time of
+# the source file, number of comments and number of tokens
+HEADER = struct.Struct('<4sIqqQQ')
+MAGIC = b'UDC1'
+VERSION = 1
+
+class Vocabulary:
+    """
+    Shared vocabulary that maps words to integer token ids and back. Ids are
+    only ever added, so token ids stored in a cache stay valid when the
+    vocabulary grows.
+    """
+    def __init__(self, path=None):
+        """
+        path: text file with one word per line, the line number being the
+              token id. If given and the file exists, the vocabulary is loaded
+              from it.
+        """
+        self.path = path
+        self.words = []
+        self.ids = {}
+        self.saved = 0
+
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as inpt:
+                for line in inpt:
+                    self.add_word(line[:-1])
+            self.saved = len(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def add_word(self, word):
+        """
+        word: string
+
+        return: token id of the word
+
+        Add word to the vocabulary if it is not known yet.
+        """
+        try:
+            return self.ids[word]
+        except KeyError:
+            self.ids[word] = len(self.words)
+            self.words.append(word)
+            return self.ids[word]
+
+    def known_mask(self, dictionary):
+        """
+        dictionary: instance of class Dictionary
+
+        return: bytearray with for every token id 1 if the word is known by
+                the dictionary, else 0
+
+        Every word is only checked once, the mask is extended when the
+        vocabulary grows. The dictionary should not change in the meantime.
+        """
+        if getattr(self, 'mask_dictionary', None) is not dictionary:
+            self.mask_dictionary = dictionary
+            self.mask = bytearray()
+        if len(self.mask) < len(self.words):
+            self.mask.extend(dictionary.check_word(word)
+                             for word in self.words[len(self.mask):])
+        return self.mask
+
+    def word(self, token_id):
+        """
+        token_id: integer
+
+        return: the word belonging to the token id
+        """
+        return self.words[token_id]
+
+    def save(self):
+        """
+        Append the words added since the last save to the vocabulary file.
+        """
+        if self.path is None or self.saved == len(self.words):
+            return
+        with open(self.path, 'a', encoding='utf-8') as outpt:
+            for word in self.words[self.saved:]:
+                outpt.write(word + '\n')
+        self.saved = len(self.words)
+
+
+class CorpusCache:
+    """
+    Cache of cleaned comments, so the json parsing and the preprocessing of
+    the TextProcessor only have to be done once per input file.
+
+    For every input file one binary file is stored, containing the creation
+    time of each comment, the offsets of the comments in a flat array of token
+    ids and the token ids themselves. The token ids refer to one vocabulary
+    shared by all files. Cache files are read memory-mapped.
+
+    The cache is stored in a folder named after the fingerprint of the
+    TextProcessor, so changing the preprocessing starts a new cache. A cache
+    file also stores the size and modification time of the input file and is
+    rebuilt when those change.
+    """
+    def __init__(self, cache_dir, textprocessor, pool=None):
+        """
+        cache_dir: folder where the cache is stored
+        textprocessor: an instance of the class TextProcessor.
+        pool: process pool from helpers.create_pool, used to clean comments
+              when building the cache
+        """
+        self.textprocessor = textprocessor
+        self.pool = pool
+        self.dir_path = os.path.join(cache_dir, textprocessor.fingerprint())
+        if not os.path.isdir(self.dir_path):
+            os.makedirs(self.dir_path)
+        self.vocabulary = Vocabulary(os.path.join(self.dir_path, 'vocab.txt'))
+
+    def cache_path(self, fle):
+        """
+        fle: path of an input file
+
+        return: path of the cache file belonging to the input file
+        """
+        key = hashlib.sha1(os.path.abspath(fle).encode('utf-8')).hexdigest()
+        return os.path.join(self.dir_path, key + '.bin')
+
+    def is_valid(self, fle):
+        """
+        fle: path of an input file
+
+        return: boolean
+
+        Check if there is a cache file for the input file that is up to date.
+        """
+        path = self.cache_path(fle)
+        if not os.path.isfile(path):
+            return False
+
+        stat = os.stat(fle)
+        with open(path, 'rb') as inpt:
+            header = inpt.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return False
+        magic, version, size, mtime, _, _ = HEADER.unpack(header)
+        return (magic == MAGIC and version == VERSION and size == stat.st_size
+                and mtime == stat.st_mtime_ns)
+
+    def comments(self, fle, start=0):
+        """
+        fle: path of an input file
+        start: number of the first comment to yield
+
+        yield: tuples (created_utc, words) of all comments in the file that are
+               not from the Reddit bot.
+
+        Reads the comments from the cache, or cleans them and builds the cache
+        if there is no valid cache for the file.
+        """
+        if self.is_valid(fle):
+            return self.read(fle, start=start)
+        return islice(self.build(fle), start, None)
+
+    def id_comments(self, fle, start=0):
+        """
+        fle: path of an input file
+        start: number of the first comment to yield
+
+        yield: tuples (created_utc, token ids) of all comments in the file that
+               are not from the Reddit bot. Token ids are an array('I') with
+               ids in self.vocabulary.
+
+        Same as comments, but without converting the token ids to words.
+        """
+        if self.is_valid(fle):
+            return self.read(fle, as_ids=True, start=start)
+        return islice(self.build(fle, as_ids=True), start, None)
+
+    def build(self, fle, as_ids=False):
+        """
+        fle: path of an input file
+        as_ids: yield token ids instead of words
+
+        yield: tuples (created_utc, words), see comments()
+
+        Clean the comments of an input file while storing them in the cache.
+        The cache file is only written when all comments are read.
+        """
+        # Imported here because helpers uses this module as well
+        from helpers import read_comments, clean_comments
+
+        stat = os.stat(fle)
+        times = array('q')
+        offsets = array('Q', [0])
+        ids = array('I')
+
+        for created_utc, words in clean_comments(read_comments(fle),
+                                                 self.textprocessor,
+                                                 pool=self.pool):
+            times.append(int(created_utc))
+            comment_ids = array('I', [self.vocabulary.add_word(word) for word in words])
+            ids.extend(comment_ids)
+            offsets.append(len(ids))
+            yield created_utc, comment_ids if as_ids else words
+
+        # Save vocabulary first, so a cache file never refers to unknown ids
+        self.vocabulary.save()
+        path = self.cache_path(fle)
+        with open(path + '.tmp', 'wb') as outpt:
+            outpt.write(HEADER.pack(MAGIC, VERSION, stat.st_size,
+                                    stat.st_mtime_ns, len(times), len(ids)))
+            times.tofile(outpt)
+            offsets.tofile(outpt)
+            ids.tofile(outpt)
+        os.replace(path + '.tmp', path)
+
+    def read(self, fle, as_ids=False, start=0):
+        """
+        fle: path of an input file
+        as_ids: yield token ids instead of words
+        start: number of the first comment to yield
+
+        yield: tuples (created_utc, words), see comments()
+
+        Read the comments of an input file from its cache file.
+        """
+        with open(self.cache_path(fle), 'rb') as inpt:
+            buffer = mmap.mmap(inpt.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(buffer)
+        try:
+            _, _, _, _, n_comments, n_tokens = HEADER.unpack(view[:HEADER.size])
+            begin = HEADER.size
+            times = view[begin:begin + 8 * n_comments].cast('q')
+            begin += 8 * n_comments
+            offsets = view[begin:begin + 8 * (n_comments + 1)].cast('Q')
+            begin += 8 * (n_comments + 1)
+            raw_ids = view[begin:begin + 4 * n_tokens]
+            ids = raw_ids.cast('I')
+
+            words = self.vocabulary.words
+            for i in range(start, n_comments):
+                if as_ids:
+                    # Copied, no views on the map may be left when closing it
+                    comment_ids = array('I')
+                    comment_ids.frombytes(raw_ids[4 * offsets[i]:4 * offsets[i + 1]])
+                    yield times[i], comment_ids
+                else:
+                    yield times[i], [words[token_id] for token_id
+                                     in ids[offsets[i]:offsets[i + 1]]]
+        finally:
+            # Views on the map have to be released before it can be closed
+            times = offsets = ids = raw_ids = None
+            view.release()
+            buffer.close()
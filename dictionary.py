@@ -1,3 +1,10 @@
+import os
+import sys
+
+import numpy as np
+
+from instrumentation import metrics
+
 class Dictionary:
     """
     Basic class for a dictionary. This basic class is used for the dictionary
@@ -6,22 +13,88 @@ class Dictionary:
     def __init__(self):
         self.words = {}
 
-    def fill_dict_from_txt(self, input_file, textprocessor):
+    def fill_dict_from_txt(self, input_file, textprocessor, prebuilt=None):
         """
         input_file: a .txt file containing a word on each single line
         textprocessor: in instance of the class TextProcessor. Make sure this is
                        the same as the one used for building a model.
+        prebuilt: path of a file to store the cleaned words in. If the file
+                  was made from the same input file with the same
+                  textprocessor, the words are read from it instead of
+                  cleaning every line again.
 
         Fills the dictionary of this class. Dictionary can be accessed via
         self.words.
         """
+        if prebuilt is not None and self.load_prebuilt(prebuilt, input_file, textprocessor):
+            return
+
+        words = []
         with open(input_file, 'r') as inpt:
             for line in inpt:
                 # line[:-1] is used because enters appear at the end of the line
                 #TODO: read in .txt file properly so [:-1] does not have to be used
                 word = textprocessor.clean_text(line[:-1])
                 if len(word) > 0:
-                    self.add_word(word[0])
+                    words.append(word[0])
+        self.add_words(words)
+
+        if prebuilt is not None:
+            self.save_prebuilt(prebuilt, input_file, textprocessor)
+
+    def prebuilt_header(self, input_file, textprocessor):
+        """
+        return: first line of a prebuilt file, identifying the input file and
+                the preprocessing
+        """
+        stat = os.stat(input_file)
+        return '# {} {} {}'.format(textprocessor.fingerprint(), stat.st_size,
+                                   stat.st_mtime_ns)
+
+    def save_prebuilt(self, prebuilt, input_file, textprocessor):
+        """
+        prebuilt: path of the prebuilt file
+        input_file: the .txt file the dictionary was filled from
+        textprocessor: the TextProcessor used for cleaning the input file
+
+        Store the words of the dictionary, see fill_dict_from_txt.
+        """
+        dir_path = os.path.dirname(prebuilt)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        with open(prebuilt + '.tmp', 'w', encoding='utf-8') as outpt:
+            outpt.write(self.prebuilt_header(input_file, textprocessor) + '\n')
+            outpt.write('\n'.join(sorted(self.words)))
+        os.replace(prebuilt + '.tmp', prebuilt)
+
+    def load_prebuilt(self, prebuilt, input_file, textprocessor):
+        """
+        prebuilt: path of the prebuilt file
+        input_file: the .txt file the dictionary should be filled from
+        textprocessor: the TextProcessor used for cleaning the input file
+
+        return: boolean, False if there is no prebuilt file for this input
+                file and textprocessor
+
+        Fill the dictionary from a prebuilt file with a single read.
+        """
+        if not os.path.isfile(prebuilt):
+            return False
+        with open(prebuilt, 'r', encoding='utf-8') as inpt:
+            lines = inpt.read().split('\n')
+        if lines[0] != self.prebuilt_header(input_file, textprocessor):
+            return False
+        self.add_words(word for word in lines[1:] if len(word) > 0)
+        return True
+
+    def add_words(self, words):
+        """
+        words: iterable of strings
+
+        Add all words to the dictionary.
+        """
+        for word in words:
+            self.add_word(word)
 
     def add_word(self, word):
         """
@@ -53,12 +126,66 @@ class Dictionary:
         except KeyError:
             return False
 
+    def filter_batch(self, batch):
+        """
+        batch: list of comments. Comment being a list of words.
+
+        return: the batch with only the words known by the dictionary
+        """
+        words = self.words
+        return [[word for word in sentence if word in words] for sentence in batch]
+
+class CompactDictionary(Dictionary):
+    """
+    Dictionary storing its words as a frozenset of interned strings. Uses less
+    memory than the basic dictionary and checks words faster, but adding or
+    removing a single word is slow. Fill it at once with fill_dict_from_txt or
+    add_words.
+    """
+    def __init__(self):
+        self.words = frozenset()
+
+    def add_words(self, words):
+        """
+        words: iterable of strings
+
+        Add all words to the dictionary at once.
+        """
+        self.words = self.words.union(sys.intern(word) for word in words)
+
+    def add_word(self, word):
+        """
+        word: string
+
+        Add word to the dictionary. Builds a new set, use add_words for more
+        words.
+        """
+        self.add_words([word])
+
+    def remove_word(self, word):
+        """
+        word: string
+
+        Remove word from the dictionary. Builds a new set.
+        """
+        self.words = self.words.difference([word])
+
+    def check_word(self, word):
+        """
+        word: string
+
+        return: boolean
+
+        Check if word exists in the dictionary.
+        """
+        return word in self.words
+
 class UrbanDict(Dictionary):
     """
     Advanced class for the Urban Dictionary. Inherits functions from basic
     dictionary class.
     """
-    def fill_dict(self, model, words, topn=10, treshold=0.6):
+    def fill_dict(self, model, words, topn=10, treshold=0.6, index=None):
         """
         model: instance of the class Model. Should be initialized first.
         words: list of words. Contains words that should be explained by the
@@ -66,6 +193,11 @@ class UrbanDict(Dictionary):
         topn: number of how many explanatory words are allowed
         treshold: float how close the explanatory words and the word to be
                   explained should at least be before explanatory word is added
+        index: instance of similarity.VectorIndex built on the model. If given,
+               similar words are searched for all words at once, which is a lot
+               faster than asking the model word by word. If the index is
+               restricted to the words of a dictionary, filter_on_dict is not
+               needed anymore.
 
         Fills the urban dictionary with words given. Adds to each word a dict of
         tuples. Each tuple contains an explanatory word and its similarity score
@@ -73,6 +205,24 @@ class UrbanDict(Dictionary):
 
         Structure: {'word': [(explained, similarity), etc], 'word': etc}
         """
+        metrics.count('urbandict.words_searched', len(words))
+        with metrics.span('urbandict.fill_dict'):
+            if index is not None:
+                self.fill_dict_from_index(index, words, topn=topn, treshold=treshold)
+            else:
+                self.fill_dict_per_word(model, words, topn=topn, treshold=treshold)
+        metrics.gauge('urbandict.words_defined', len(self.words))
+
+    def fill_dict_per_word(self, model, words, topn=10, treshold=0.6):
+        """
+        model: instance of the class Model. Should be initialized first.
+        words: list of words that should be explained by the urban dictionary
+        topn: number of how many explanatory words are allowed
+        treshold: minimum similarity score of an explanatory word
+
+        Fill the urban dictionary by asking the model for the similar words of
+        one word at a time, see fill_dict.
+        """
         # Loop over given words and add to dictionary
         for word in words:
             self.add_word(word)
@@ -90,6 +240,25 @@ class UrbanDict(Dictionary):
             if len(self.words[word]) == 0:
                 self.remove_word(word)
 
+    def fill_dict_from_index(self, index, words, topn=10, treshold=0.6):
+        """
+        index: instance of similarity.VectorIndex
+        words: list of words that should be explained by the urban dictionary
+        topn: number of how many explanatory words are allowed
+        treshold: minimum similarity score of an explanatory word
+
+        Same as fill_dict, but with the similar words of all words retrieved
+        at once from the index.
+        """
+        similar_words = index.most_similar(words, topn=topn, treshold=treshold)
+
+        # Only add words that have at least one explanatory word
+        for word in words:
+            if len(similar_words[word]) > 0:
+                self.add_word(word)
+                for meaning in similar_words[word]:
+                    self.add_meaning(word, meaning)
+
     def add_word(self, word):
         """
         word: string
@@ -129,15 +298,12 @@ class UrbanDict(Dictionary):
         Keep in mind that this function overrides the existing dictionary this
         functions is called upon.
         """
-        # Iterate over all words in urban dict. Store all meanings that are not
-        # known by the given dictionary
+        # Iterate over all words in urban dict. Only keep the meanings that are
+        # known by the given dictionary. The lists are rebuilt at once, instead
+        # of removing the unknown meanings one by one.
         for word in self.words.keys():
-            unknown_items = [item for item in self.words[word]
-                                  if not dictionary.check_word(item[0])]
-
-            # Remove all unknown meanings from the current word
-            for item in unknown_items:
-                self.remove_meaning(word, item)
+            self.words[word] = [item for item in self.words[word]
+                                     if dictionary.check_word(item[0])]
 
         # Store all words that don't have a meaning anymore
         empty_words = [word for word in self.words.keys()
@@ -159,3 +325,99 @@ class UrbanDict(Dictionary):
         for word, meaning in self.words.items():
             output[word] = meaning[:topn]
         return output
+
+class IncrementalUrbanDict(UrbanDict):
+    """
+    Urban dictionary that is kept from one batch to the next. Only the words
+    that are new, or whose vector moved more than a tolerance since they were
+    last searched, are searched again. The other words keep their meanings,
+    even if the vectors of their meanings moved, or if a new word would now
+    be a better meaning.
+    """
+    def __init__(self, tolerance=0.05):
+        """
+        tolerance: a word is searched again when the cosine similarity of its
+                   current vector and its vector at the last search is below
+                   1 - tolerance. Use 0 to search all words every update
+                   that are compared, see the changed argument of update.
+                   Words outside changed are never searched again, whatever
+                   the tolerance.
+        """
+        self.words = {}
+        self.tolerance = tolerance
+        # Normalized vector of every searched word at its last search, also
+        # of the words that got no meanings
+        self.vectors = {}
+
+    def update(self, index, words, topn=10, treshold=0.6, changed=None):
+        """
+        index: instance of similarity.VectorIndex built on the current model
+        words: list of words that should be explained by the urban dictionary,
+               e.g. from Model.unknown_words
+        topn: number of how many explanatory words are allowed
+        treshold: minimum similarity score of an explanatory word
+        changed: set of words that may have been trained since the last
+                 update, e.g. helpers.batch_words of the batch. Other
+                 words that were searched before are not even compared. None
+                 to compare all words.
+
+        return: dict with the difference with the previous state. 'added' and
+                'changed' map words to their new meanings, 'removed' is a list
+                of words that are not defined anymore.
+
+        Words that are not in words anymore are removed. The meanings of a
+        word are replaced, never changed in place.
+        """
+        diff = {'added': {}, 'changed': {}, 'removed': []}
+        words = list(words)
+        current = set(words)
+        for word in [word for word in self.vectors if word not in current]:
+            del self.vectors[word]
+            if word in self.words:
+                del self.words[word]
+                diff['removed'].append(word)
+
+        with metrics.span('urbandict.update'):
+            if changed is not None:
+                # Only new words and words of the batch can have moved
+                words = [word for word in words
+                         if word in changed or word not in self.vectors]
+            search = self.moved_words(index, words)
+            metrics.count('urbandict.words_searched', len(search))
+            similar_words = index.most_similar(search, topn=topn, treshold=treshold)
+
+            for word in search:
+                meanings = similar_words[word]
+                if len(meanings) > 0:
+                    if word not in self.words:
+                        diff['added'][word] = meanings
+                    elif self.words[word] != meanings:
+                        diff['changed'][word] = meanings
+                    self.words[word] = meanings
+                elif word in self.words:
+                    del self.words[word]
+                    diff['removed'].append(word)
+
+        metrics.count('urbandict.words_changed', len(diff['added']) + len(diff['changed'])
+                      + len(diff['removed']))
+        metrics.gauge('urbandict.words_defined', len(self.words))
+        return diff
+
+    def moved_words(self, index, words):
+        """
+        index: instance of similarity.VectorIndex built on the current model
+        words: list of words in the vocabulary of the model
+
+        return: list of the words that are new or whose vector moved more than
+                the tolerance. Their current vectors are stored.
+        """
+        if len(words) == 0:
+            return []
+        vectors = index.query_vectors(words)
+        moved = []
+        for word, vector in zip(words, vectors):
+            previous = self.vectors.get(word)
+            if previous is None or np.dot(previous, vector) < 1 - self.tolerance:
+                self.vectors[word] = vector.copy()
+                moved.append(word)
+        return moved
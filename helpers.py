@@ -1,21 +1,51 @@
 import json
-from datetime import datetime, date, timedelta
+import queue
+import re
+import threading
+import resource
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime
+from itertools import chain, islice
+from multiprocessing import Pool
+
+from array import array
+
+from corpuscache import CorpusCache, Vocabulary
+from instrumentation import metrics
 
 def create_stream_from_files(files, textprocessor, time_delta=12,
-                             minimum_words=20, **kwargs):
+                             minimum_words=20, cache_dir=None, workers=1,
+                             as_ids=False, start=None, sketch=None, **kwargs):
     """
     files: list of filepaths to extract text from. Needs to be in list, even
            when only one file given. Should be files in the same format as the
            ones provided in de dataset.
     textprocessor: an instance of the class TextProcessor.
-    batch_size: number of comments retrieved before moving forward to the model.
-                Because this function yields a list to the model, whenever the
-                model asks for a new batch (due to a forloop), this function is
+    time_delta: number of hours of comments in one batch. Because this
+                function yields a batch to the model, whenever the model asks
+                for a new batch (due to a forloop), this function is
                 proceeded again.
                 Find some more information about yield here:
         https://pythontips.com/2013/09/29/the-python-yield-keyword-explained/
     minimum_words: minimum words in a comment after preprocessing before this
                    comment is actually added to the batch
+    cache_dir: folder to cache the cleaned comments in (see CorpusCache). If
+               given, files are only parsed and cleaned the first time they
+               are streamed. Later streams read the cleaned comments from the
+               cache.
+    workers: number of processes used for cleaning the comments. With more
+             than one worker, comments are cleaned in chunks by a process pool.
+             The order of the comments stays the same.
+    as_ids: yield batches of token ids instead of lists of words, see
+            create_batches. Uses less memory. With a cache_dir, the token ids
+            are read from the cache without converting them to words.
+    start: position to start the stream at, the 'position' of a batch of an
+           earlier stream of the same files. Comments before it are not read
+           again. Used to resume a stream, see checkpoint.py.
+    sketch: instance of sketch.SlangSketch, every batch is added to it before
+            it is yielded
 
     **kwargs are arguments passed to clean_text function. If no extra arguments,
     default is taken in clean_text. Pass arguments for clean_text by calling
@@ -25,54 +55,539 @@ def create_stream_from_files(files, textprocessor, time_delta=12,
     usefull for extracting only known words at initialization of a model.
     (see model TODO for that)
 
-    yield: list of comments. Comments being a list of words.
+    yield: dict with the date of the batch and a list of comments. Comments
+           being a list of words. The dict also has the 'position' in the
+           files where the next batch starts, see file_comments.
     """
+    pool = create_pool(textprocessor, workers)
+    try:
+        cache = None
+        if cache_dir is not None:
+            cache = CorpusCache(cache_dir, textprocessor, pool=pool)
+        vocabulary = None
+        if as_ids:
+            vocabulary = cache.vocabulary if cache is not None else Vocabulary()
 
-    # Setup variables, mostly used for printing updates of the progress
-    #TODO: make nice updates of the progress... Now it is still a bit messy...
-    batch = []
-    starting_line = True
+        # Position of the last comment read by create_batches. When a batch is
+        # yielded, that is the first comment of the next batch.
+        position = {'file': 0, 'comment': 0, 'offset': 0}
+        if start is not None:
+            position.update(start)
+        comments = chain.from_iterable(
+            file_comments(fle, number, textprocessor, position, cache=cache,
+                          pool=pool, vocabulary=vocabulary, start=start)
+            for number, fle in enumerate(files)
+            if start is None or number >= start['file'])
 
-    # Iterate over the input files until caller (the model in our case) stops
-    # asking for a new batch
-    for file_number, fle in enumerate(files):
+        for batch in create_batches(comments, time_delta=time_delta,
+                                    minimum_words=minimum_words,
+                                    vocabulary=vocabulary,
+                                    resumed=start is not None):
+            batch['position'] = dict(position)
+            if sketch is not None:
+                sketch.add_batch(batch)
+            yield batch
+    finally:
+        if pool is not None:
+            pool.terminate()
 
-        # Open file and read line by line. Each line contains a json object.
-        # Each json object consists of a body and the utc time the comment
-        # was created.
-        with open(fle, 'r') as inpt:
-            for line in inpt:
+def file_comments(fle, number, textprocessor, position, cache=None, pool=None,
+                  vocabulary=None, start=None):
+    """
+    fle: filepath of a file in the format of the dataset
+    number: index of the file in the list of files of the stream
+    textprocessor: an instance of the class TextProcessor.
+    position: dict that is updated with the position of every comment that is
+              yielded: the index of the 'file', the number of the 'comment'
+              in the file and the byte 'offset' of its line (None if read
+              from the cache). At the end of the file, it is set to the start
+              of the next file.
+    cache: instance of CorpusCache to read the cleaned comments from
+    pool: process pool created by create_pool
+    vocabulary: instance of corpuscache.Vocabulary to yield token ids in
+    start: position to start at, only used if it is in this file
 
-                text = json.loads(line)
+    yield: tuples (created_utc, words) of the file, see
+           create_stream_from_files
+    """
+    skip, offset = 0, 0
+    if start is not None and start['file'] == number:
+        skip, offset = start['comment'], start['offset']
 
-                # Filter out comments of the Reddit bot (saying that you can't
-                # spam or whatever...)
-                if '*[I am a bot]' in text['body']:
-                    continue
+    if cache is not None and (skip == 0 or cache.is_valid(fle)):
+        if vocabulary is not None:
+            comments = cache.id_comments(fle, start=skip)
+        else:
+            comments = cache.comments(fle, start=skip)
+        for comment_number, (created_utc, words) in enumerate(comments, skip):
+            position.update(file=number, comment=comment_number, offset=None)
+            yield created_utc, words
+    else:
+        # The byte offsets of the comments read ahead by clean_comments
+        offsets = deque()
+        if offset is None:
+            # Only the comment number is known, read up to it again
+            comments = read_comments(fle, positions=offsets)
+            for _ in islice(comments, skip):
+                offsets.popleft()
+        else:
+            comments = read_comments(fle, start=offset, positions=offsets)
 
-                # Send text of a comment to the preprocessor
-                date = datetime.fromtimestamp(text['created_utc'])
+        for comment_number, (created_utc, words) in enumerate(
+                clean_comments(comments, textprocessor, pool=pool), skip):
+            position.update(file=number, comment=comment_number,
+                            offset=offsets.popleft())
+            if vocabulary is not None:
+                words = array('I', [vocabulary.add_word(word) for word in words])
+            yield created_utc, words
 
-                if starting_line:
-                    current_date = date
-                    batch = {'date': current_date.strftime('%Y-%m-%d %H:%M'), 'comments': []}
-                    starting_line = False
+    position.update(file=number + 1, comment=0, offset=0)
 
-                text = textprocessor.clean_text(text['body'])
+# A json string without the quotes, allowing escaped characters
+JSON_STRING = rb'([^"\\\n]*(?:\\.[^"\\\n]*)*)'
+# Matches one line of a file. A comment with only a body and created_utc, in
+# either order, is matched by the first two alternatives. Any other line is
+# caught by the last one and parsed by the json module.
+LINE_PATTERN = re.compile(rb'^(?:\{"body":\s*"' + JSON_STRING + rb'",\s*"created_utc":\s*(\d+)\}'
+                          rb'|\{"created_utc":\s*(\d+),\s*"body":\s*"' + JSON_STRING + rb'"\}'
+                          rb'|(.*?))\r?$', re.MULTILINE)
+BOT_MARKER = '*[I am a bot]'
+BOT_MARKER_BYTES = BOT_MARKER.encode('utf-8')
 
+def read_comments(fle, chunk_size=16 * 1024 ** 2, start=0, positions=None):
+    """
+    fle: filepath of a file in the format of the dataset
+    chunk_size: number of bytes read from the file at once
+    start: byte offset to start reading at, should be the start of a line
+    positions: deque. If given, the byte offset of the line of every yielded
+               comment is appended to it.
+
+    yield: tuples (created_utc, body) of all comments not made by the bot
 
-                # Append comment text to the batch if it has the minimum
-                # required number of words
-                if date - current_date < timedelta(hours=time_delta):
-                    if len(text) >= minimum_words:
-                        batch['comments'].append(text)
+    Reads the file in large chunks and extracts the body and created_utc of
+    all lines of a chunk with one regex, instead of parsing every line as a
+    json object. Comments of the bot are dropped before their body is
+    decoded. Gives the same output as read_comments_json.
+    """
+    reading_start = time.perf_counter()
+    lines = 0
+    bots = 0
+    with open(fle, 'rb') as inpt:
+        inpt.seek(start)
+        chunk_start = start
+        rest = b''
+        while True:
+            chunk = inpt.read(chunk_size)
+            if len(chunk) == 0:
+                chunk, rest = rest, b''
+                if len(chunk) == 0:
+                    break
+            else:
+                # The last line of a chunk is only complete in the next chunk
+                chunk = rest + chunk
+                split = chunk.rfind(b'\n') + 1
+                chunk, rest = chunk[:split], chunk[split:]
 
+            for match in LINE_PATTERN.finditer(chunk):
+                body, created_utc, created_utc_first, body_last, other = match.groups()
+
+                if other is not None:
+                    # Unexpected format or empty line
+                    if len(other.strip()) == 0:
+                        continue
+                    lines += 1
+                    text = json.loads(other)
+                    created_utc, body = text['created_utc'], text['body']
                 else:
-                    current_date = date
-                    yield batch
-                    batch = {'date': current_date.strftime('%Y-%m-%d %H:%M'), 'comments': [text]}
+                    lines += 1
+                    if body is None:
+                        body, created_utc = body_last, created_utc_first
+                    created_utc = int(created_utc)
+
+                    # Filter out comments of the Reddit bot (saying that you
+                    # can't spam or whatever...) before decoding the body
+                    if BOT_MARKER_BYTES in body:
+                        bots += 1
+                        continue
+                    if b'\\' in body:
+                        body = json.loads(b'"' + body + b'"')
+                    else:
+                        body = body.decode('utf-8')
+
+                # The marker can still be in a body with escaped characters
+                if BOT_MARKER in body:
+                    bots += 1
+                    continue
+                if positions is not None:
+                    positions.append(chunk_start + match.start())
+                yield created_utc, body
+            chunk_start += len(chunk)
+
+    metrics.count('comments.read', lines)
+    metrics.count('comments.dropped_bot', bots)
+    seconds = time.perf_counter() - reading_start
+    if seconds > 0:
+        metrics.gauge('reader.lines_per_second', lines / seconds)
+
+def read_comments_json(fle):
+    """
+    fle: filepath of a file in the format of the dataset
+
+    yield: tuples (created_utc, body) of all comments not made by the bot
+
+    Parses every line completely with the json module. Slower than
+    read_comments.
+    """
+    # Open file and read line by line. Each line contains a json object.
+    # Each json object consists of a body and the utc time the comment
+    # was created.
+    with open(fle, 'r') as inpt:
+        for line in inpt:
+
+            text = json.loads(line)
+            metrics.count('comments.read')
+
+            # Filter out comments of the Reddit bot (saying that you can't
+            # spam or whatever...)
+            if BOT_MARKER in text['body']:
+                metrics.count('comments.dropped_bot')
+                continue
+
+            yield text['created_utc'], text['body']
+
+def clean_comments(comments, textprocessor, pool=None, chunk_size=500):
+    """
+    comments: iterable of tuples (created_utc, body)
+    textprocessor: an instance of the class TextProcessor.
+    pool: process pool created by create_pool. If given, the comments are
+          cleaned in chunks by the processes of the pool.
+    chunk_size: number of comments send to a process at once
+
+    yield: tuples (created_utc, words), in the same order as the comments
+    """
+    if pool is None:
+        for created_utc, body in comments:
+            words = textprocessor.clean_text(body)
+            metrics.count('comments.cleaned')
+            metrics.count('tokens.cleaned', len(words))
+            yield created_utc, words
+        return
+
+    # Keep a few chunks per process in progress, so the processes don't have
+    # to wait, without reading the whole input in memory
+    comments = iter(comments)
+    pending = deque()
+    max_pending = 2 * pool.workers
+    while True:
+        while len(pending) < max_pending:
+            chunk = list(islice(comments, chunk_size))
+            if len(chunk) == 0:
+                break
+            pending.append(pool.apply_async(_clean_chunk, (chunk,)))
+
+        if len(pending) == 0:
+            return
+        for created_utc, words in pending.popleft().get():
+            metrics.count('comments.cleaned')
+            metrics.count('tokens.cleaned', len(words))
+            yield created_utc, words
+
+def create_pool(textprocessor, workers=1):
+    """
+    textprocessor: an instance of the class TextProcessor.
+    workers: number of processes
+
+    return: CleaningPool for clean_comments, or None if workers is 1 or less
+
+    Every process gets its own copy of the textprocessor. Terminate the pool
+    when it isn't needed anymore.
+    """
+    if workers is None or workers <= 1:
+        return None
+    return CleaningPool(textprocessor, workers)
+
+class CleaningPool:
+    """
+    Process pool for clean_comments. The processes are only started when the
+    first chunk is cleaned, so a stream read from the corpus cache doesn't
+    start them at all.
+    """
+    def __init__(self, textprocessor, workers):
+        """
+        textprocessor: an instance of the class TextProcessor.
+        workers: number of processes
+        """
+        self.textprocessor = textprocessor
+        self.workers = workers
+        self.pool = None
+
+    def apply_async(self, function, args):
+        if self.pool is None:
+            self.pool = Pool(self.workers, initializer=_init_worker,
+                             initargs=(self.textprocessor,))
+        return self.pool.apply_async(function, args)
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+# TextProcessor of a process in the pool, set by _init_worker
+_worker_textprocessor = None
+
+def _init_worker(textprocessor):
+    global _worker_textprocessor
+    _worker_textprocessor = textprocessor
+
+def _clean_chunk(chunk):
+    return [(created_utc, _worker_textprocessor.clean_text(body))
+            for created_utc, body in chunk]
+
+def count_words(files, textprocessor, time_delta=12, minimum_words=20,
+                dictionary=None, workers=1, cache_dir=None):
+    """
+    files: list of filepaths in the format of the dataset
+    textprocessor: an instance of the class TextProcessor.
+    time_delta: number of hours of comments in one batch
+    minimum_words: minimum words in a comment after preprocessing before the
+                   comment is counted
+    dictionary: instance of class Dictionary. If given, only words known by
+                the dictionary are counted.
+    workers: number of processes cleaning the comments, see
+             create_stream_from_files
+    cache_dir: folder of the CorpusCache. If given, files that are cached are
+               not cleaned again, and the others are cached while counting.
+
+    return: tuple (word counts, number of comments). The word counts are a
+            Counter of all words in all files.
+
+    The comments are counted from the batches of create_stream_from_files,
+    so exactly the comments that are trained are counted. Which comments
+    are kept depends on where the batches start, see create_batches.
+    """
+    counts = Counter()
+    comments = 0
+    vocabulary = None
+    for batch in create_stream_from_files(files, textprocessor, time_delta=time_delta,
+                                          minimum_words=minimum_words, workers=workers,
+                                          cache_dir=cache_dir, as_ids=True):
+        # Count the token ids, the words are only looked up once at the end
+        counts.update(batch['ids'])
+        comments += batch_length(batch)
+        vocabulary = batch['vocabulary']
+
+    if vocabulary is None:
+        return Counter(), 0
+    known = vocabulary.known_mask(dictionary) if dictionary is not None else None
+    return Counter({vocabulary.words[token_id]: count for token_id, count in counts.items()
+                    if known is None or known[token_id]}), comments
+
+class PrefetchCorpus:
+    """
+    Iterable over all comments of a stream of batches, which can be iterated
+    more than once (e.g. once per epoch by gensim). On every iteration a
+    producer thread reads the batches ahead into a bounded queue, so the
+    consumer does not have to wait for reading and preprocessing.
+
+    Every iteration creates a new stream. Without a cache_dir, that stream
+    parses and cleans all files again.
+    """
+    def __init__(self, create_stream, dictionary=None, prefetch=10000):
+        """
+        create_stream: function without arguments returning a new stream of
+                       batches, e.g. a lambda calling create_stream_from_files
+        dictionary: instance of class Dictionary. If given, words unknown by
+                    the dictionary are left out.
+        prefetch: maximum number of comments read ahead
+        """
+        self.create_stream = create_stream
+        self.dictionary = dictionary
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        comments = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            # Give up when the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    comments.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.create_stream():
+                    for sentence in batch_sentences(batch, self.dictionary):
+                        if not put(sentence):
+                            return
+                put(end)
+            except BaseException as error:
+                put(error)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                sentence = comments.get()
+                if sentence is end:
+                    return
+                if isinstance(sentence, BaseException):
+                    raise sentence
+                yield sentence
+        finally:
+            stop.set()
+
+def create_batches(comments, time_delta=12, minimum_words=20, vocabulary=None,
+                   resumed=False):
+    """
+    comments: iterable of tuples (created_utc, words), ordered by time
+    time_delta: number of hours of comments in one batch
+    minimum_words: minimum words in a comment before this comment is actually
+                   added to the batch
+    vocabulary: instance of corpuscache.Vocabulary. If given, the words of
+                the comments are token ids in this vocabulary and batches of
+                token ids are made.
+    resumed: the comments start at the 'position' of a batch of an earlier
+             stream. The first comment is then always added, like it was
+             when it started a new batch in that stream.
+
+    yield: dict with the date of the batch and a list of comments. With a
+           vocabulary, the dict has the date, an array 'ids' with the token
+           ids of all comments after each other, an array 'offsets' with
+           where each comment starts (and where the last one ends) and the
+           'vocabulary'. Use batch_sentences to get the comments as words.
+    """
+    # Setup variables, mostly used for printing updates of the progress
+    #TODO: make nice updates of the progress... Now it is still a bit messy...
+    batch = []
+    starting_line = True
+
+    # Iterate over the comments until caller (the model in our case) stops
+    # asking for a new batch
+    for created_utc, text in comments:
+
+        # Compare the raw timestamps, a date is only made for a new batch.
+        # Dates are local time, like datetime.fromtimestamp.
+        if starting_line:
+            current_utc = created_utc
+            current_date = datetime.fromtimestamp(created_utc)
+            batch = new_batch(current_date.strftime('%Y-%m-%d %H:%M'), vocabulary)
+            starting_line = False
+            if resumed:
+                add_comment(batch, text)
+                continue
+
+        # Append comment text to the batch if it has the minimum
+        # required number of words
+        if created_utc - current_utc < time_delta * 3600:
+            if len(text) >= minimum_words:
+                add_comment(batch, text)
+            else:
+                metrics.count('comments.dropped_minimum_words')
+
+        else:
+            current_utc = created_utc
+            current_date = datetime.fromtimestamp(created_utc)
+            yield batch
+            batch = new_batch(current_date.strftime('%Y-%m-%d %H:%M'), vocabulary)
+            add_comment(batch, text)
 
     # And yield last batch, which isn't the size of batch_size because there
     # are no more comments in the files given
     if len(batch) > 0:
         yield batch
+
+def new_batch(date, vocabulary=None):
+    """
+    date: string with the date of the batch
+    vocabulary: instance of corpuscache.Vocabulary for a batch of token ids
+
+    return: empty batch, see create_batches
+    """
+    if vocabulary is None:
+        return {'date': date, 'comments': []}
+    return {'date': date, 'ids': array('I'), 'offsets': array('Q', [0]),
+            'vocabulary': vocabulary}
+
+def add_comment(batch, text):
+    """
+    batch: batch made by new_batch
+    text: list of words, or array of token ids for a batch of token ids
+    """
+    if 'ids' in batch:
+        batch['ids'].extend(text)
+        batch['offsets'].append(len(batch['ids']))
+    else:
+        batch['comments'].append(text)
+
+def batch_length(batch):
+    """
+    batch: batch of words or token ids
+
+    return: number of comments in the batch
+    """
+    if 'ids' in batch:
+        return len(batch['offsets']) - 1
+    return len(batch['comments'])
+
+def batch_words(batch):
+    """
+    batch: batch of words or token ids
+
+    return: set of the distinct words of the batch
+    """
+    if 'ids' in batch:
+        words = batch['vocabulary'].words
+        return {words[token_id] for token_id in set(batch['ids'])}
+    return {word for comment in batch['comments'] for word in comment}
+
+def batch_sentences(batch, dictionary=None):
+    """
+    batch: batch of words or token ids
+    dictionary: instance of class Dictionary. If given, only words known by
+                the dictionary are kept.
+
+    return: list of comments. Comment being a list of words.
+
+    For a batch of token ids, the dictionary filter is done on the token ids
+    and only the remaining ids are converted to words.
+    """
+    if 'ids' not in batch:
+        if dictionary is not None:
+            return dictionary.filter_batch(batch['comments'])
+        return batch['comments']
+
+    words = batch['vocabulary'].words
+    ids = batch['ids']
+    offsets = batch['offsets']
+    if dictionary is None:
+        return [[words[token_id] for token_id in ids[offsets[i]:offsets[i + 1]]]
+                for i in range(len(offsets) - 1)]
+
+    known = batch['vocabulary'].known_mask(dictionary)
+    return [[words[token_id] for token_id in ids[offsets[i]:offsets[i + 1]]
+             if known[token_id]]
+            for i in range(len(offsets) - 1)]
+
+def batch_to_json(batch):
+    """
+    batch: batch of words or token ids
+
+    return: batch of words, that can be written as json
+    """
+    return {'date': batch['date'], 'comments': batch_sentences(batch)}
+
+def peak_memory():
+    """
+    return: peak resident memory of this process so far, in megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+    return peak / 1024
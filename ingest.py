@@ -0,0 +1,266 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import queue
+import threading
+import time
+
+import helpers
+
+# Put on the output queue when the source has no more comments
+END = object()
+# Seconds between two checks of the stop event while waiting
+STOP_INTERVAL = 0.1
+
+class IngestMetrics:
+    """
+    Counts the comments going through the stages of an ingestion stream, so
+    the rate of fetching, cleaning and consuming can be compared.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.ingested = 0
+        self.cleaned = 0
+        self.consumed = 0
+
+    def rates(self):
+        """
+        return: dict with comments per second ingested, cleaned and consumed
+                since the start of the stream
+        """
+        seconds = max(time.time() - self.start, 1e-9)
+        return {'ingested': self.ingested / seconds,
+                'cleaned': self.cleaned / seconds,
+                'consumed': self.consumed / seconds}
+
+    def report(self):
+        """
+        return: string with the counts and rates of all stages
+        """
+        rates = self.rates()
+        return ('ingested {} ({:.0f}/s), cleaned {} ({:.0f}/s), '
+                'consumed {} ({:.0f}/s)'.format(self.ingested, rates['ingested'],
+                                                self.cleaned, rates['cleaned'],
+                                                self.consumed, rates['consumed']))
+
+class ReplaySource:
+    """
+    Local stand-in for the Reddit comment stream. Replays the comments of
+    files in the format of the dataset, optionally at a fixed rate, so the
+    ingestion can be tested offline.
+    """
+    def __init__(self, files, rate=None):
+        """
+        files: list of filepaths in the format of the dataset
+        rate: number of comments per second. None to replay as fast as
+              possible.
+        """
+        self.files = files
+        self.rate = rate
+
+    def fetch(self):
+        """
+        yield: tuples (created_utc, body). Blocking, called from a thread.
+        """
+        start = time.time()
+        for number, comment in enumerate(self.all_comments()):
+            if self.rate is not None:
+                delay = start + number / self.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield comment
+
+    def all_comments(self):
+        for fle in self.files:
+            for comment in helpers.read_comments(fle):
+                yield comment
+
+class RedditSource:
+    """
+    Comments of a subreddit, fetched with the blocking praw stream.
+    """
+    def __init__(self, communicator, subreddit='all'):
+        """
+        communicator: authenticated instance of the class Communicator
+        subreddit: which subreddit to use, see Communicator.stream_comments
+        """
+        self.communicator = communicator
+        self.subreddit = subreddit
+
+    def fetch(self):
+        """
+        yield: tuples (created_utc, body). Blocking, called from a thread.
+        """
+        stream = self.communicator.auth.subreddit(self.subreddit).stream.comments()
+        for comment in stream:
+            yield comment.created_utc, comment.body
+
+def stream_batches(source, textprocessor, time_delta=12, minimum_words=20,
+                   workers=1, chunk_size=100, max_queue=10000, metrics=None,
+                   verbose=False):
+    """
+    source: instance of ReplaySource or RedditSource
+    textprocessor: an instance of the class TextProcessor.
+    time_delta: number of hours of comments in one batch
+    minimum_words: minimum words in a comment after preprocessing before this
+                   comment is actually added to the batch
+    workers: number of processes used for cleaning. With 1, cleaning is done
+             in a thread.
+    chunk_size: number of comments cleaned by one process at once
+    max_queue: maximum number of comments waiting between two stages
+    metrics: instance of IngestMetrics to count in, a new one if not given
+    verbose: print the metrics after every batch
+
+    yield: the same batches as helpers.create_stream_from_files
+
+    Fetching, cleaning and batching run concurrently. Fetching and cleaning
+    are done by an asyncio event loop in a background thread, connected by
+    queues, so waiting for the network and preprocessing overlap.
+    """
+    metrics = metrics or IngestMetrics()
+    output = queue.Queue(maxsize=max_queue)
+    stop = threading.Event()
+
+    thread = threading.Thread(target=asyncio.run,
+                              args=(ingest(source, textprocessor, output, stop,
+                                           metrics, workers=workers,
+                                           chunk_size=chunk_size,
+                                           max_queue=max_queue),),
+                              daemon=True)
+    thread.start()
+
+    try:
+        for batch in helpers.create_batches(read_queue(output, metrics),
+                                            time_delta=time_delta,
+                                            minimum_words=minimum_words):
+            if verbose:
+                print('{} {}'.format(batch['date'], metrics.report()))
+            yield batch
+    finally:
+        stop.set()
+
+def read_queue(output, metrics):
+    """
+    yield: cleaned comments from the output queue of ingest until the end of
+           the source. Raises the error of the ingestion if it failed.
+    """
+    while True:
+        item = output.get()
+        if item is END:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        metrics.consumed += 1
+        yield item
+
+async def ingest(source, textprocessor, output, stop, metrics, workers=1,
+                 chunk_size=100, max_queue=10000):
+    """
+    Fetch comments from the source and clean them, putting the cleaned
+    comments (created_utc, words) on the output queue in their original order.
+    Stops when the stop event is set, e.g. when the consumer is gone.
+    """
+    loop = asyncio.get_running_loop()
+    raw = asyncio.Queue(maxsize=max_queue)
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=helpers._init_worker,
+                                       initargs=(textprocessor,))
+
+    async def fetch():
+        comments = source.fetch()
+        while not stop.is_set():
+            # The sources are blocking, so fetch in a thread
+            comment = await loop.run_in_executor(None, next, comments, END)
+            await raw.put(comment)
+            if comment is END:
+                return
+            metrics.ingested += 1
+
+    async def clean():
+        while True:
+            # Wait for one comment, then take what is available up to a chunk
+            # per process
+            chunk = [await raw.get()]
+            while chunk[-1] is not END and len(chunk) < chunk_size * workers and not raw.empty():
+                chunk.append(raw.get_nowait())
+
+            done = chunk[-1] is END
+            if done:
+                chunk.pop()
+
+            if executor is not None:
+                parts = [chunk[i:i + chunk_size] for i in range(0, len(chunk), chunk_size)]
+                results = await asyncio.gather(*[
+                    loop.run_in_executor(executor, helpers._clean_chunk, part)
+                    for part in parts])
+                cleaned = [item for result in results for item in result]
+            else:
+                cleaned = await loop.run_in_executor(None, clean_chunk,
+                                                     textprocessor, chunk)
+
+            for item in cleaned:
+                try:
+                    output.put_nowait(item)
+                except queue.Full:
+                    # The consumer is behind, wait in a thread to not block
+                    # the event loop
+                    await loop.run_in_executor(None, put_until_stopped,
+                                               output, item, stop)
+            metrics.cleaned += len(cleaned)
+
+            if done:
+                return
+
+    async def stopped():
+        while not stop.is_set():
+            await asyncio.sleep(STOP_INTERVAL)
+
+    work = asyncio.gather(fetch(), clean())
+    watch = asyncio.ensure_future(stopped())
+    try:
+        await asyncio.wait([work, watch], return_when=asyncio.FIRST_COMPLETED)
+        if not work.done():
+            # The consumer is gone, nobody reads the queues anymore
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            return
+        work.result()
+        result = END
+    except BaseException as error:
+        result = error
+    finally:
+        watch.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    await loop.run_in_executor(None, put_until_stopped, output, result, stop)
+
+def put_until_stopped(output, item, stop):
+    """
+    Put item on the output queue, waiting while it is full. Gives up when the
+    stop event is set.
+
+    return: boolean, False if the item was not put on the queue
+    """
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=STOP_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def clean_chunk(textprocessor, chunk):
+    return [(created_utc, textprocessor.clean_text(body))
+            for created_utc, body in chunk]
+
+if __name__ == '__main__':
+    import sys
+    from textprocessor import TextProcessor
+
+    # Usage: python ingest.py <comments per second or 0> <file> [<file> ...]
+    rate = float(sys.argv[1]) or None
+    source = ReplaySource(sys.argv[2:], rate=rate)
+    metrics = IngestMetrics()
+    for batch in stream_batches(source, TextProcessor(fast=True), metrics=metrics):
+        print('{} {} comments, {}'.format(batch['date'], helpers.batch_length(batch),
+                                          metrics.report()))
@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+class Instruments:
+    """
+    Collects named spans (timed stages), counters and gauges of the current
+    batch. All modules report into the shared instance `metrics` of this
+    module. At the end of a batch, emit writes everything as one json line and
+    starts counting again.
+
+    A single stage of a single batch can be profiled with cProfile and
+    tracemalloc, see profile.
+    """
+    def __init__(self):
+        self.output = None
+        self.verbose = False
+        self.profile_stage = None
+        self.profile_batch = None
+        self.profile_dir = None
+        self.batch = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all spans, counters and gauges of the current batch.
+        """
+        self.spans = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def configure(self, output=None, verbose=False):
+        """
+        output: path of a file to append a json line to for every batch. None
+                to not write anything.
+        verbose: print the duration of every span when it ends
+        """
+        self.output = output
+        self.verbose = verbose
+
+    def profile(self, stage, batch, profile_dir='.'):
+        """
+        stage: name of the span to profile, e.g. 'model.train'
+        batch: label of the batch to profile, as given to start_batch
+        profile_dir: folder to write the profile to
+
+        Profiles the stage during that batch only. Writes a cProfile file
+        <stage>-<batch>.prof, which can be read with pstats or snakeviz, and
+        <stage>-<batch>.memory.txt with the lines allocating most memory.
+        """
+        self.profile_stage = stage
+        self.profile_batch = batch
+        self.profile_dir = profile_dir
+
+    def start_batch(self, batch):
+        """
+        batch: label of the batch, e.g. its date
+
+        Counts made since the last emit are kept. They belong to this batch,
+        e.g. the comments read and dropped while the stream produced it.
+        """
+        self.batch = batch
+
+    @contextmanager
+    def span(self, name):
+        """
+        name: name of the stage
+
+        Time the code in a with statement. Spans with the same name in one
+        batch are added up.
+        """
+        profiling = (name == self.profile_stage
+                     and self.batch is not None
+                     and str(self.batch) == str(self.profile_batch))
+        if profiling:
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            profiler.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiling:
+                profiler.disable()
+                self.dump_profile(name, profiler)
+
+            span = self.spans.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            span['seconds'] += seconds
+            span['calls'] += 1
+            if self.verbose:
+                print('{:.3f}s {}'.format(seconds, name))
+
+    def dump_profile(self, name, profiler):
+        """
+        Write the profile and memory allocations of a stage, see profile.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        label = '{}-{}'.format(name, self.batch).replace(' ', '_').replace(':', '')
+        path = os.path.join(self.profile_dir, label)
+        profiler.dump_stats(path + '.prof')
+        with open(path + '.memory.txt', 'w') as outpt:
+            outpt.write('peak {:.1f} MB\n'.format(peak / 1024 ** 2))
+            for stat in snapshot.statistics('lineno')[:50]:
+                outpt.write(str(stat) + '\n')
+        print('profile of {} written to {}.prof'.format(name, path))
+
+    def count(self, name, value=1):
+        """
+        name: name of the counter
+        value: number added to the counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """
+        name: name of the gauge
+        value: current value, overwrites the previous one
+        """
+        self.gauges[name] = value
+
+    def seconds(self, name):
+        """
+        name: name of a span
+
+        return: seconds spent in the span during the current batch
+        """
+        return self.spans.get(name, {}).get('seconds', 0.0)
+
+    def summary(self):
+        """
+        return: dict with the batch label, spans, counters and gauges
+        """
+        return {'batch': self.batch, 'spans': self.spans,
+                'counters': self.counters, 'gauges': self.gauges}
+
+    def emit(self):
+        """
+        return: the summary of the batch
+
+        Write the summary of the current batch to the output file and start
+        counting for a new batch.
+        """
+        summary = self.summary()
+        if self.output is not None:
+            with open(self.output, 'a') as outpt:
+                outpt.write(json.dumps(summary) + '\n')
+        self.reset()
+        return summary
+
+# Shared instance all modules report into
+metrics = Instruments()
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+import argparse
+import json
+import random
+import time
+
+def request(url):
+    """
+    url: url of the request
+
+    return: tuple (seconds, status)
+    """
+    start = time.perf_counter()
+    try:
+        with urlopen(url) as response:
+            response.read()
+            status = response.status
+    except HTTPError as error:
+        error.read()
+        status = error.code
+    return time.perf_counter() - start, status
+
+def percentile(values, fraction):
+    """
+    values: sorted list of numbers
+    fraction: e.g. 0.99
+
+    return: value below which the fraction of the values lie
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def load_test(base_url, words, requests=10000, concurrency=8, seed=1):
+    """
+    base_url: url of the service, e.g. http://127.0.0.1:8080
+    words: list of words to define. Words are drawn with a Zipf-like
+           distribution, so some are asked a lot (cache hits) and most are
+           asked rarely.
+    requests: total number of requests
+    concurrency: number of requests at the same time
+
+    return: dict with the latency percentiles in milliseconds, the queries
+            per second and the number of requests per status
+    """
+    random_generator = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    urls = ['{}/define?word={}'.format(base_url, quote(word))
+            for word in random_generator.choices(words, weights=weights, k=requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(request, urls))
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {'requests': requests, 'concurrency': concurrency,
+            'qps': requests / seconds,
+            'p50_ms': percentile(latencies, 0.5),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1],
+            'statuses': statuses}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the definition service of service.py')
+    parser.add_argument('words', help='file with a word on every line, e.g. data/words.txt, '
+                                      'or an urban dict json file to use its words')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.words, 'r') as inpt:
+        content = inpt.read()
+    try:
+        words = list(json.loads(content))
+    except ValueError:
+        words = [word for word in content.split('\n') if len(word) > 0]
+
+    result = load_test(args.url, words, requests=args.requests, concurrency=args.concurrency)
+    print('{requests} requests, {concurrency} at once: {qps:.0f} queries/s, '
+          'p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, max {max_ms:.2f} ms, '
+          'statuses {statuses}'.format(**result))
+    with urlopen(args.url + '/info') as response:
+        print('service {}'.format(response.read().decode('utf-8')))
@@ -1,12 +1,29 @@
-from gensim.models import Word2Vec
+from bisect import bisect_left, insort
+from copy import copy, deepcopy
 import os
 
+import numpy as np
+
+from instrumentation import metrics
+import helpers
+
+def word2vec():
+    """
+    return: the gensim Word2Vec class
+
+    gensim is imported when a model is created or loaded instead of when this
+    module is imported, importing it takes about a second.
+    """
+    from gensim.models import Word2Vec
+    return Word2Vec
+
 class Model:
     """
     Basic class for the Word2Vec model.
     The original gensim Word2Vec class will be stored in self.model.
     """
-    def initialize(self, stream, min_count=10, iterations=10, dictionary=None):
+    def initialize(self, stream, min_count=10, iterations=10, dictionary=None,
+                   workers=2):
         #TODO: make iterations go on forever. (iterations=None, or somehting?)
         #TODO: add more parameters which can be given to to Word2Vec initialization
         # for optimization
@@ -17,19 +34,20 @@ class Model:
                    taken in the model.
         iterations: stream can be made definite by setting the iterations. Use
                     high iterations to make sure all comments from file are read
+        workers: number of threads gensim uses for training
 
         Initializes the Word2Vec model. However, even in the initalization the
         online training method is already used. If you want to really initalize
         on a bigger set of comments, increase the batch_size of the stream.
         """
         # Instantiate Word2Vec model from gensim
-        self.model = Word2Vec(min_count=min_count, workers=2)
+        Word2Vec = word2vec()
+        self.model = Word2Vec(min_count=min_count, workers=workers)
         # print(len(list(stream)))
         # Call for first batch in stream to initialize model
         for batch in stream:
-            batch = batch['comments']
-            if dictionary:
-                batch = [[word for word in sentence if dictionary.check_word(word)] for sentence in batch]
+            # Convert to words here, batches can also be token ids
+            batch = helpers.batch_sentences(batch, dictionary or None)
             self.build_vocab(batch)
             self.train(batch)
             break
@@ -38,20 +56,158 @@ class Model:
         if iterations > 1:
             self.update(stream, iterations=iterations-1, dictionary=dictionary)
 
+    def initialize_parallel(self, files, textprocessor, min_count=10,
+                            dictionary=None, time_delta=12, minimum_words=20,
+                            workers=4, training_workers=4, cache_dir=None):
+        """
+        files: list of filepaths in the format of the dataset
+        textprocessor: an instance of the class TextProcessor.
+        min_count: minimal occurence of a word in all files before its taken in
+                   the model.
+        dictionary: instance of class Dictionary. If given, only words known by
+                    the dictionary are used.
+        time_delta, minimum_words: see helpers.create_stream_from_files
+        cache_dir: folder of the CorpusCache. The files are cleaned once while
+                   counting the words, and every epoch reads them from the
+                   cache. Without it, every epoch cleans all files again.
+        workers: number of processes for cleaning comments
+        training_workers: number of threads gensim uses for training
+
+        Initializes the Word2Vec model on all files at once instead of batch by
+        batch. First the vocabulary is built from the word counts of all
+        comments of the stream, cleaned in parallel by a process pool. Then
+        the model is trained on all comments, which are read and cleaned
+        ahead by a producer thread so the training threads don't have to
+        wait.
+
+        Unlike initialize, min_count applies to the counts of all files
+        together instead of to every batch separately.
+        """
+        with metrics.span('model.count_words'):
+            counts, comments = helpers.count_words(files, textprocessor,
+                                                   time_delta=time_delta,
+                                                   minimum_words=minimum_words,
+                                                   dictionary=dictionary,
+                                                   workers=workers,
+                                                   cache_dir=cache_dir)
+
+        Word2Vec = word2vec()
+        self.model = Word2Vec(min_count=min_count, workers=training_workers)
+        with metrics.span('model.build_vocab'):
+            self.model.build_vocab_from_freq(counts, corpus_count=comments)
+        metrics.gauge('model.vocab_size', len(self.model.wv.vocab))
+
+        corpus = helpers.PrefetchCorpus(
+            lambda: helpers.create_stream_from_files(files, textprocessor,
+                                                     time_delta=time_delta,
+                                                     minimum_words=minimum_words,
+                                                     cache_dir=cache_dir,
+                                                     workers=workers),
+            dictionary=dictionary)
+        with metrics.span('model.train'):
+            self.model.train(corpus, total_examples=comments,
+                             epochs=self.model.iter)
+
     def train(self, batch):
         """
         batch: list of comments. Comment being a list of words.
         """
         total_examples = self.model.corpus_count + len(batch)
         epochs = self.model.iter
-        self.model.train(batch, total_examples=total_examples, epochs=epochs)
+        tokens = sum(len(sentence) for sentence in batch)
+        with metrics.span('model.train'):
+            self.model.train(batch, total_examples=total_examples, epochs=epochs)
+        metrics.count('model.sentences_trained', len(batch))
+        metrics.count('model.tokens_trained', tokens)
+        seconds = metrics.seconds('model.train')
+        if seconds > 0:
+            metrics.gauge('model.tokens_per_second', metrics.counters['model.tokens_trained'] / seconds)
 
     def build_vocab(self, batch, update=False):
         """
         batch: list of comments. Comment being a list of words.
         update: if new words in comments, update should be set to true
         """
-        self.model.build_vocab(batch, update=update)
+        vocab_size = len(self.model.wv.vocab) if update else 0
+        with metrics.span('model.build_vocab'):
+            self.model.build_vocab(batch, update=update)
+            unknown_index = getattr(self, 'unknown_index', None)
+            if unknown_index is not None:
+                if update:
+                    unknown_index.update(self.model.wv.vocab, batch)
+                else:
+                    # New vocabulary, the index has to be built again
+                    self.unknown_index = None
+        metrics.count('model.new_words', len(self.model.wv.vocab) - vocab_size)
+
+        vocab_bound = getattr(self, 'vocab_bound', None)
+        if vocab_bound is not None:
+            vocab_bound.update(self.model.wv.vocab, batch)
+            evicted = vocab_bound.evicted_words(self.model.wv.vocab)
+            if len(evicted) > 0:
+                with metrics.span('model.evict_words'):
+                    self.remove_words(evicted)
+                metrics.count('model.words_evicted', len(evicted))
+        metrics.gauge('model.vocab_size', len(self.model.wv.vocab))
+
+    def bound_vocab(self, max_size, decay=0.9, slack=0.1):
+        """
+        max_size: maximum number of words in the vocabulary
+        decay: factor the score of every word is multiplied with per batch
+        slack: fraction of max_size evicted extra, so words don't have to be
+               evicted on every batch
+
+        Keep the vocabulary at most max_size words, so the model can be
+        updated on a stream forever without growing. Every word has a score
+        that is increased by its count in every batch and decays by the
+        given factor per batch. When build_vocab makes the vocabulary bigger
+        than max_size, the words with the lowest score are removed. Recent
+        words have a high score, so new slang keeps being admitted. Only for
+        models using negative sampling.
+        """
+        if self.model.hs:
+            raise ValueError('a bounded vocabulary needs negative sampling, not hierarchical softmax')
+        self.vocab_bound = VocabularyBound(self.model.wv.vocab, max_size,
+                                           decay=decay, slack=slack)
+
+    def remove_words(self, words):
+        """
+        words: iterable of words in the vocabulary
+
+        Remove words from the model. The vectors of the words are removed from
+        all weight matrices and the remaining words get consecutive indexes
+        again, so the memory of the removed words is freed.
+        """
+        wv = self.model.wv
+        remove = set(word for word in words if word in wv.vocab)
+        if len(remove) == 0:
+            return
+        keep = np.array([index for index, word in enumerate(wv.index2word)
+                         if word not in remove], dtype=np.int64)
+
+        # Selecting rows makes new arrays, the old ones (possibly
+        # memory-mapped from a snapshot) are released
+        wv.vectors = wv.vectors[keep]
+        trainables = self.model.trainables
+        trainables.syn1neg = trainables.syn1neg[keep]
+        trainables.vectors_lockf = trainables.vectors_lockf[keep]
+
+        for word in remove:
+            del wv.vocab[word]
+        wv.index2word = [wv.index2word[index] for index in keep]
+        for index, word in enumerate(wv.index2word):
+            wv.vocab[word].index = index
+        wv.vectors_norm = None
+
+        # Table of the noise distribution of negative sampling, by index
+        self.model.vocabulary.make_cum_table(wv)
+
+        unknown_index = getattr(self, 'unknown_index', None)
+        if unknown_index is not None:
+            for word in remove:
+                unknown_index.remove(word)
+        if getattr(self, 'vocab_bound', None) is not None:
+            self.vocab_bound.remove(remove)
 
     def update(self, stream, iterations=10, dictionary=None):
         """
@@ -64,9 +220,8 @@ class Model:
         # Keep track of number of batches retrieved to stop when iterations
         # is reached.
         for itr, batch in enumerate(stream):
-            batch = batch['comments']
-            if dictionary:
-                batch = [[word for word in sentence if dictionary.check_word(word)] for sentence in batch]
+            # Convert to words here, batches can also be token ids
+            batch = helpers.batch_sentences(batch, dictionary or None)
             self.build_vocab(batch, update=True)
             self.train(batch)
             if itr >= iterations - 1:
@@ -78,19 +233,84 @@ class Model:
         min_occurence: minimum number of occurences in the Gensim Word2Vec model
                        before taken as unknown word.
 
-        return: list of words
+        return: list of words, most occuring first
 
-        This function iterates over all words in the Gensim Word2Vec model and
-        adds it to the output if it occurs in the given dictionary.
+        Returns all words in the Gensim Word2Vec model that do not occur in the
+        given dictionary. The first call builds an UnknownWordIndex by going
+        over the whole vocabulary once. After that the index is kept up to
+        date by build_vocab, so only the words of new batches are looked at.
         """
-        not_words = []
-
-        for word in self.model.wv.vocab:
-            if not dictionary.check_word(word):
-                if self.model.wv.vocab[word].count > min_occurence:
-                    not_words.append(word)
+        with metrics.span('model.unknown_words'):
+            unknown_index = getattr(self, 'unknown_index', None)
+            if unknown_index is None or unknown_index.dictionary is not dictionary:
+                self.unknown_index = UnknownWordIndex(self.model.wv.vocab, dictionary)
+            not_words = self.unknown_index.words(min_occurence)
+        metrics.gauge('model.unknown_words', len(not_words))
         return not_words
 
+    def snapshot(self, dir_path):
+        """
+        dir_path: the folder where the snapshot is stored
+
+        Saves the model with all its large arrays in separate files, so working
+        copies can be made cheaply with working_copy.
+        """
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        # sep_limit=0 stores every numpy array in its own .npy file
+        self.model.save(dir_path + '/model', sep_limit=0)
+        self.snapshot_path = dir_path
+
+    def load_snapshot(self, dir_path):
+        """
+        dir_path: folder of a snapshot made with snapshot
+
+        Load a snapshot with its arrays memory-mapped read-only, e.g. to share
+        one base model between processes. Working copies are memory-mapped
+        from the same files.
+        """
+        self.model = word2vec().load(dir_path + '/model', mmap='r')
+        self.snapshot_path = dir_path
+
+    def working_copy(self):
+        """
+        return: new instance of Model with the same state as this model
+
+        If a snapshot was made, the arrays of the copy are memory-mapped from
+        the snapshot copy-on-write. Pages are shared until the copy changes
+        them, so making a copy is fast and cheap in memory. Without a snapshot
+        the model is deep-copied.
+        """
+        if getattr(self, 'snapshot_path', None) is None:
+            return deepcopy(self)
+
+        copy = Model()
+        copy.model = word2vec().load(self.snapshot_path + '/model', mmap='c')
+        if getattr(self, 'unknown_index', None) is not None:
+            copy.unknown_index = self.unknown_index.copy()
+        if getattr(self, 'vocab_bound', None) is not None:
+            copy.vocab_bound = self.vocab_bound.copy()
+        return copy
+
+    def detached(self):
+        """
+        return: new instance of Model sharing all arrays with this model
+
+        Gensim temporarily removes the large arrays from a model while saving
+        it. Saving a detached model instead leaves this model untouched, so it
+        can still be read during the save, e.g. by a BackgroundWriter. The
+        model should not be trained until the save is done, because the arrays
+        are shared.
+        """
+        detached = Model()
+        detached.model = copy(self.model)
+
+        # Also copy the parts of the model gensim saves separately, like wv
+        for name, value in vars(detached.model).items():
+            if hasattr(value, '_save_specials'):
+                setattr(detached.model, name, copy(value))
+        return detached
+
     def save(self, dir_path):
         """
         dir_path: the folder where you want to save the model
@@ -104,10 +324,177 @@ class Model:
             os.makedirs(dir_path)
         self.model.save(dir_path + '/model')
 
-    def load(self, dir_path):
+    def load(self, dir_path, mmap=None):
         """
         dir_path: folder where the model is saved
+        mmap: None to read the model in memory, or 'r' to memory-map the
+              arrays saved in separate files read-only
 
         Loads the model
         """
-        self.model = Word2Vec.load(dir_path + '/model')
+        self.model = word2vec().load(dir_path + '/model', mmap=mmap)
+
+
+class UnknownWordIndex:
+    """
+    Keeps the words of a model that are unknown by a dictionary, ordered by
+    their count in the model. Every word is only checked in the dictionary
+    once, and the words occuring more than a minimum can be retrieved in time
+    proportional to the number of words returned.
+
+    The index is updated with the words of every new batch. If words are
+    added to or removed from the dictionary, a new index should be built.
+    """
+    def __init__(self, vocab, dictionary):
+        """
+        vocab: vocabulary of a gensim Word2Vec model (model.wv.vocab)
+        dictionary: instance of class Dictionary
+        """
+        self.dictionary = dictionary
+        self.known = set()
+        self.counts = {}
+        for word, item in vocab.items():
+            if dictionary.check_word(word):
+                self.known.add(word)
+            else:
+                self.counts[word] = item.count
+
+        # Sorted list of (-count, word), so the most occuring words come first
+        self.order = sorted((-count, word) for word, count in self.counts.items())
+
+    def copy(self):
+        """
+        return: copy of the index that can be updated separately
+        """
+        index = copy(self)
+        index.known = set(self.known)
+        index.counts = dict(self.counts)
+        index.order = list(self.order)
+        return index
+
+    def update(self, vocab, batch):
+        """
+        vocab: vocabulary of the model after build_vocab on the batch
+        batch: list of comments. Comment being a list of words.
+
+        Update the counts of the unknown words in the batch and add the new
+        words of the batch that are unknown by the dictionary.
+        """
+        for word in set(word for sentence in batch for word in sentence):
+            if word in self.known:
+                continue
+            item = vocab.get(word)
+            if item is None:
+                # Not in the model, e.g. because of min_count
+                continue
+
+            count = self.counts.get(word)
+            if count is None:
+                if self.dictionary.check_word(word):
+                    self.known.add(word)
+                    continue
+            elif count == item.count:
+                continue
+            else:
+                del self.order[bisect_left(self.order, (-count, word))]
+
+            self.counts[word] = item.count
+            insort(self.order, (-item.count, word))
+
+    def remove(self, word):
+        """
+        word: string
+
+        Remove a word that is no longer in the model.
+        """
+        self.known.discard(word)
+        count = self.counts.pop(word, None)
+        if count is not None:
+            del self.order[bisect_left(self.order, (-count, word))]
+
+    def words(self, min_occurence=100):
+        """
+        min_occurence: minimum number of occurences
+
+        return: list of unknown words occuring more than min_occurence times,
+                most occuring first
+        """
+        end = bisect_left(self.order, (-min_occurence, ''))
+        return [word for _, word in self.order[:end]]
+
+class VocabularyBound:
+    """
+    Decayed scores of the words of a model, used to choose the words to
+    evict when the vocabulary grows beyond a maximum size, see
+    Model.bound_vocab.
+
+    Decaying all scores on every batch would take time proportional to the
+    vocabulary, so every score is stored with the batch it was last updated
+    in and decayed when it is read.
+    """
+    def __init__(self, vocab, max_size, decay=0.9, slack=0.1):
+        """
+        vocab: vocabulary of a gensim Word2Vec model (model.wv.vocab). The
+               words start with their count as score.
+        max_size, decay, slack: see Model.bound_vocab
+        """
+        self.max_size = max_size
+        self.decay = decay
+        self.slack = slack
+        self.batches = 0
+        # Word to tuple (score, batch of the last update)
+        self.scores = {word: (item.count, 0) for word, item in vocab.items()}
+
+    def copy(self):
+        """
+        return: copy that can be updated separately
+        """
+        bound = copy(self)
+        bound.scores = dict(self.scores)
+        return bound
+
+    def score(self, word):
+        """
+        return: current score of the word, 0 if it has none
+        """
+        score, batch = self.scores.get(word, (0, self.batches))
+        return score * self.decay ** (self.batches - batch)
+
+    def update(self, vocab, batch):
+        """
+        vocab: vocabulary of the model after build_vocab on the batch
+        batch: list of comments. Comment being a list of words.
+
+        Start a new batch and add the counts of its words to their scores.
+        Words that are not in the model get no score, so the scores stay
+        bounded as well.
+        """
+        self.batches += 1
+        counts = {}
+        for sentence in batch:
+            for word in sentence:
+                counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.items():
+            if word not in vocab:
+                continue
+            self.scores[word] = (self.score(word) + count, self.batches)
+
+    def evicted_words(self, vocab):
+        """
+        vocab: vocabulary of the model
+
+        return: list of words to remove from the model, empty if the
+                vocabulary is not bigger than the maximum size
+        """
+        if len(vocab) <= self.max_size:
+            return []
+        target = int(self.max_size * (1 - self.slack))
+        ranked = sorted(vocab, key=self.score)
+        return ranked[:len(vocab) - target]
+
+    def remove(self, words):
+        """
+        words: words removed from the model
+        """
+        for word in words:
+            self.scores.pop(word, None)
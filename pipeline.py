@@ -1,80 +1,223 @@
-from copy import deepcopy
-import json
 import os
-import time
-from datetime import timedelta, datetime
-from dictionary import Dictionary, UrbanDict
+from datetime import datetime
+from dictionary import UrbanDict, IncrementalUrbanDict
+from window import SlidingWindow
+from similarity import VectorIndex, AnnIndex
+from helpers import peak_memory, batch_length, batch_words
+from writer import BackgroundWriter, publish_model
+from checkpoint import checkpoint_state, write_checkpoint, load_checkpoint
+from urbanlog import UrbanDictLog
+from windowstore import WindowStore
+from instrumentation import metrics
+from model import Model
+
+def pipeline(stream, model, dictionary, minimum_word_occurence=100, meaning_score_treshold=0.6, time_delta=12, time_frames=7, rebuild_every=None, ann_settings=None, snapshot_dir='../Models/Base', max_pending_writes=4, metrics_file='../Metrics/metrics.jsonl', profile=None, textprocessor=None, checkpoint_file=None, checkpoint_every=1, resume=None, incremental_settings=None, max_vocab=None, sketch=None, window_dir='../Window', output_dir='..'):
+    """
+    metrics_file: file to append the spans, counters and gauges of every batch
+                  to as json lines. None to not write them.
+    profile: tuple (stage, batch date), e.g. ('model.train', '2015-01-20 00:00').
+             Profiles that stage during that batch only, see
+             instrumentation.Instruments.profile.
+    textprocessor: the TextProcessor of the stream, to report its lemma cache.
+                   Leave it out when the stream cleans the comments in a
+                   process pool, the processes have their own caches.
+    checkpoint_file: file to write a checkpoint to, see checkpoint.py. None to
+                     not write checkpoints.
+    checkpoint_every: number of batches between two checkpoints
+    resume: checkpoint loaded with checkpoint.load_checkpoint. The window and
+            its model are restored from it instead of from the database. The
+            stream should start at the position of the checkpoint.
+    incremental_settings: dict, e.g. {'tolerance': 0.05, 'snapshot_every': 24}.
+                          If given, the urban dict is kept between batches and
+                          only words that are new or moved are searched again
+                          (see IncrementalUrbanDict). Unless the window was
+                          rebuilt, only the words of the batch can have
+                          moved, so only they are compared. The meanings of
+                          words outside the batch are not refreshed until
+                          the next rebuild, even when their meanings moved.
+                          ../Urban_Dicts then gets a diff per batch
+                          and a full snapshot every snapshot_every batches,
+                          see urbanlog.py.
+    max_vocab: maximum number of words in the vocabulary of the model. Words
+               that were not seen for a while are evicted, see
+               Model.bound_vocab. None to let the vocabulary grow.
+    sketch: instance of sketch.SlangSketch that the stream adds its batches
+            to. Its heavy hitters and their growth are reported as a gauge.
+            It only reports, the words that are defined don't depend on it.
+    window_dir: folder of the WindowStore with the batches of the window
+    snapshot_dir: folder to snapshot the base model in. None if the model is
+                  already a snapshot, see Model.load_snapshot.
+    output_dir: folder to write the Models, Urban_Dicts and Profiles folders
+                in
+    """
+    models_dir = os.path.join(output_dir, 'Models')
+    urban_dir = os.path.join(output_dir, 'Urban_Dicts')
+    if not os.path.isdir(urban_dir):
+        os.makedirs(urban_dir)
+
+    if metrics_file is not None:
+        metrics_dir = os.path.dirname(metrics_file)
+        if metrics_dir and not os.path.isdir(metrics_dir):
+            os.makedirs(metrics_dir)
+    metrics.configure(output=metrics_file, verbose=True)
+    if profile is not None:
+        metrics.profile(profile[0], profile[1], profile_dir=os.path.join(output_dir, 'Profiles'))
 
-def pipeline(stream, model, dictionary, minimum_word_occurence=100, meaning_score_treshold=0.6, time_delta=12, time_frames=7):
     print('starting model {}'.format(model.model))
-    updating_model = deepcopy(model)
-    to_update = []
+    metrics.start_batch('start')
+
+    if max_vocab is not None:
+        model.bound_vocab(max_vocab)
+
+    # Snapshot the base model once, after that copies of it are memory-mapped
+    if snapshot_dir is not None:
+        with metrics.span('pipeline.snapshot'):
+            model.snapshot(snapshot_dir)
+
+    # All output is written in the background, so writing overlaps with
+    # defining the urban dict and training on the next batch
+    writer = BackgroundWriter(max_pending=max_pending_writes)
+
+    # The batches of the window are kept on disk, only their dates in memory.
+    # New batches are written by the writer as well.
+    store = WindowStore(window_dir)
+    window = SlidingWindow(model, time_frames=time_frames, rebuild_every=rebuild_every, store=store,
+                           writer=writer)
+
+    if resume is not None:
+        # Continue with the model and window of the checkpoint
+        with metrics.span('pipeline.resume'):
+            print('resuming after {}'.format(resume['date']))
+            resumed_model = Model()
+            resumed_model.load(resume['model'])
+            if max_vocab is not None:
+                resumed_model.bound_vocab(max_vocab)
+            # Batches stored after the checkpoint are trained again
+            store.retain(resume['window'])
+            window.restore(resumed_model, [{'date': date} for date in resume['window']],
+                           resume['steps_since_rebuild'])
+    else:
+        # Fill the window once with the batches left in the store by an
+        # earlier run
+        with metrics.span('pipeline.lookup_window'):
+            dates = store.dates()[-(time_frames - 1):] if time_frames > 1 else []
+            print('number of batches', len(dates))
+            store.retain(dates)
+            for date in dates:
+                window.add_past_batch({'date': date})
+            if len(window.batches) > 0:
+                window.rebuild()
+    metrics.gauge('memory.peak_mb', peak_memory())
+    metrics.emit()
+
+    # The writer is closed when the stream fails as well, so the writes that
+    # are already queued are still done
+    with writer:
+        model_saved = None
+        expired_dates = []
 
-    start = datetime.now()
-    for batch in stream:
-        print('\n\nUpdating model, {}\n'.format(batch['date']))
-        str_date = str(batch['date'])
+        if incremental_settings is not None:
+            settings = dict(incremental_settings)
+            urban_log = UrbanDictLog(urban_dir, writer,
+                                     snapshot_every=settings.pop('snapshot_every', 24))
+            incremental_urban = IncrementalUrbanDict(**settings)
 
-        lookup_datebase_start = datetime.now()
-        files = os.listdir('../Database')
-        print('number of files', len(files))
-        if len(files) >= (time_frames - 1):
-            print('updating from past')
-            updating_model = deepcopy(model)
+        start = datetime.now()
+        for batch in stream:
+            print('\n\nUpdating model, {}\n'.format(batch['date']))
+            str_date = str(batch['date'])
+            metrics.start_batch(str_date)
 
-            for fle in files:
-                with open('../Database/' + fle, 'r') as inpt:
-                    old_batch = json.load(inpt)
-                    updating_model.update([old_batch])
-        lookup_database_end = datetime.now()
-        print('{} lookup database'.format(lookup_database_end - lookup_datebase_start))
+            # The model can only be trained again when it is completely saved
+            if model_saved is not None:
+                with metrics.span('pipeline.wait_for_save'):
+                    model_saved.result()
 
-        updating_start = datetime.now()
-        updating_model.update([batch])
-        updating_end = datetime.now()
-        print('{} updating on new batch'.format(updating_end - updating_start))
+            with metrics.span('pipeline.update'):
+                replayed, expired = window.step(batch)
+                updating_model = window.model
+            metrics.count('window.batches_replayed', replayed)
+            metrics.gauge('window.saved_seconds', window.last_saved.total_seconds())
+            metrics.count('pipeline.comments', batch_length(batch))
 
-        updating_model.save('../Models/' + str_date)
+            model_dir = os.path.join(models_dir, str_date)
+            model_saved = writer.save_model(updating_model, model_dir)
+            # Point the query service to the new model once it is saved
+            writer.submit(publish_model, os.path.join(models_dir, 'latest'), model_dir,
+                          wait_for=[model_saved])
 
-        with open('../Database/' + str_date + '.json', 'w') as outpt:
-            json.dump(batch, outpt)
+            with metrics.span('pipeline.define_urbandict'):
+                # Setup Urban Dictionary
+                # First get words in model that are unknown by the dictionary
+                unknown = updating_model.unknown_words(dictionary, min_occurence=minimum_word_occurence)
 
-        remove_date = datetime.strptime(batch['date'], '%Y-%m-%d %H:%M') - timedelta(hours=((time_frames - 1) * time_delta))
-        remove_file = remove_date.strftime('%Y-%m-%d %H:%M') + '.json'
+                # Only search the words known by the original dictionary, so the meanings
+                # don't have to be filtered afterwards
+                # Optionally use an approximate index, see similarity.benchmark_ann for
+                # choosing its settings, e.g. {'tables': 8, 'bits': 12}
+                if ann_settings is not None:
+                    index = AnnIndex(updating_model, candidates=dictionary.words, **ann_settings)
+                else:
+                    index = VectorIndex(updating_model, candidates=dictionary.words)
 
-        try:
-            os.remove('../Database/' + remove_file)
-        except OSError:
-            pass
+                # Create and fill Urban Dictionary, or update the one of the
+                # previous batch
+                if incremental_settings is not None:
+                    urban = incremental_urban
+                    changed = None
+                    if replayed == 0:
+                        # Only the words of the batch were trained
+                        changed = batch_words(batch)
+                        metrics.gauge('urbandict.batch_words', len(changed))
+                    diff = urban.update(index, unknown, topn=1000, treshold=meaning_score_treshold,
+                                        changed=changed)
+                else:
+                    urban = UrbanDict()
+                    urban.fill_dict(updating_model, unknown, topn=1000, treshold=meaning_score_treshold, index=index)
 
-        define_urbandict_start = datetime.now()
-        # Setup Urban Dictionary
-        # First get words in model that are unknown by the dictionary
-        unknown = updating_model.unknown_words(dictionary, min_occurence=minimum_word_occurence)
+            if incremental_settings is not None:
+                urban_log.write(str_date, urban, diff)
+            else:
+                writer.dump_json(urban.words, os.path.join(urban_dir, str_date), indent='\t')
 
-        # Create and fill Urban Dictionary
-        urban = UrbanDict()
-        urban.fill_dict(updating_model, unknown, topn=1000, treshold=meaning_score_treshold)
+            # Writes are done in order, so the checkpoint is written after the
+            # model it refers to
+            if expired is not None:
+                expired_dates.append(expired['date'])
+            checkpointed = False
+            if checkpoint_file is not None and window.batches_trained % checkpoint_every == 0:
+                writer.submit(write_checkpoint, checkpoint_file,
+                              checkpoint_state(window, batch, model_dir),
+                              wait_for=[model_saved])
+                checkpointed = True
 
-        # Filter Urban Dict to only keep meanings known by the original dictionary
-        urban.filter_on_dict(dictionary)
+            # The batches that fell out of the window are not needed anymore. They
+            # are removed after a checkpoint that doesn't refer to them anymore.
+            if checkpoint_file is None or checkpointed:
+                for date in expired_dates:
+                    writer.submit(store.remove, date)
+                expired_dates = []
 
-        define_urbandict_end = datetime.now()
-        print('{} define urbandict'.format(define_urbandict_end - define_urbandict_start))
+            if sketch is not None:
+                metrics.gauge('sketch.heavy_hitters', sketch.heavy_hitters(n=20))
+            if textprocessor is not None and textprocessor.fast:
+                textprocessor.report(metrics)
+            metrics.gauge('memory.peak_mb', peak_memory())
+            metrics.emit()
 
-        with open('../Urban_Dicts/' + str_date, 'w') as outpt:
-            json.dump(urban.words, outpt, indent='\t')
+        # Make sure everything is written before finishing
+        metrics.start_batch('end')
+        with metrics.span('pipeline.wait_for_writes'):
+            writer.close()
+        metrics.emit()
 
     print('{} entire process'.format(datetime.now() - start))
 
 if __name__ == '__main__':
-    from model import Model
-    from dictionary import Dictionary, UrbanDict
+    from dictionary import CompactDictionary
     from textprocessor import TextProcessor
-    from communicator import Communicator
+    from sketch import SlangSketch
     import helpers
-    from pprint import pprint
-    import nltk
 
     init_stream_files = ['../Data/01-01.txt', '../Data/01-02.txt', '../Data/01-03.txt', '../Data/01-04.txt', '../Data/01-05.txt', '../Data/01-06.txt',
                          '../Data/01-07.txt', '../Data/01-08.txt', '../Data/01-09.txt', '../Data/01-10.txt', '../Data/01-11.txt', '../Data/01-12.txt',
@@ -84,29 +227,64 @@ if __name__ == '__main__':
                            '../Data/01-27.txt', '../Data/01-28.txt', '../Data/01-29.txt', '../Data/01-30.txt', '../Data/01-31.txt']
 
     dictionary_file = 'data/words.txt'
+    dictionary_prebuilt = '../Cache/words.prebuilt'
+    lemmas_prebuilt = '../Cache/lemmas.prebuilt'
     models_dir = '../Models/'
+    cache_dir = '../Cache'
+    preprocessing_workers = os.cpu_count()
+    training_workers = os.cpu_count()
+    parallel_initialization = True
     minimum_words_in_comments = 20
     minimum_word_count = 100
     time_delta = 24
     time_frames = 7
+    # Delete the checkpoint to start again from the initialization
+    checkpoint_file = '../Checkpoints/pipeline.json'
 
     # Create instances of classes
     model = Model()
-    textProcessor = TextProcessor()
-    dictionary = Dictionary()
+    textProcessor = TextProcessor(fast=True)
+    dictionary = CompactDictionary()
+    dictionary.fill_dict_from_txt(dictionary_file, textProcessor, prebuilt=dictionary_prebuilt)
+    # Lemmas of the dictionary words, so WordNet is only loaded for other words
+    if not textProcessor.load_lemmas(lemmas_prebuilt):
+        with open(dictionary_file, 'r') as inpt:
+            textProcessor.save_lemmas(lemmas_prebuilt, (word for line in inpt
+                                                        for word in textProcessor.fast_tokenize(line[:-1])))
 
-    # Or initialize model with stream from the dataset
-    stream = helpers.create_stream_from_files(init_stream_files, textProcessor, time_delta=time_delta, minimum_words=minimum_words_in_comments)
-    model.initialize(stream, min_count=minimum_word_count, iterations=99999999, dictionary=dictionary)
-    initialization_end = datetime.now()
-    model.load('../Models/Init')
+    # Resume a run that was stopped, without initializing again
+    resume = load_checkpoint(checkpoint_file)
+    if resume is not None:
+        model.load('../Models/Init')
+    else:
+        # Or initialize model with stream from the dataset
+        initialization_start = datetime.now()
+        if parallel_initialization:
+            # Count the vocabulary of all files in parallel, then train on all files
+            model.initialize_parallel(init_stream_files, textProcessor, min_count=minimum_word_count, dictionary=dictionary,
+                                      time_delta=time_delta, minimum_words=minimum_words_in_comments, workers=preprocessing_workers,
+                                      training_workers=training_workers, cache_dir=cache_dir)
+        else:
+            stream = helpers.create_stream_from_files(init_stream_files, textProcessor, time_delta=time_delta, minimum_words=minimum_words_in_comments, cache_dir=cache_dir, workers=preprocessing_workers, as_ids=True)
+            model.initialize(stream, min_count=minimum_word_count, iterations=99999999, dictionary=dictionary, workers=training_workers)
+        initialization_end = datetime.now()
+        model.load('../Models/Init')
 
-    print('{} created the initialization model. Here is the summary\n{}'.format((initialization_end - initialization_start), model.model))
+        print('{} created the initialization model. Here is the summary\n{}'.format((initialization_end - initialization_start), model.model))
 
-    model.save('../Models/Init')
+        model.save('../Models/Init')
 
-    unknown = model.unknown_words(dictionary, min_occurence=1)
-    print('If {} is 0, then initalization worked well'.format(unknown))
+        unknown = model.unknown_words(dictionary, min_occurence=1)
+        print('If {} is 0, then initalization worked well'.format(unknown))
 
-    stream = helpers.create_stream_from_files(update_stream_files, textProcessor, time_delta=time_delta, minimum_words=minimum_words_in_comments)
-    pipeline(stream, model, dictionary, minimum_word_occurence=minimum_word_count, time_delta=time_delta, time_frames=time_frames)
+    # Batches of token ids, the window keeps several of them in memory. When
+    # resuming, the stream starts after the last batch of the checkpoint.
+    # The sketch reports the most frequent unknown words of every batch and
+    # their growth as metrics.
+    sketch = SlangSketch(dictionary)
+    stream = helpers.create_stream_from_files(update_stream_files, textProcessor, time_delta=time_delta, minimum_words=minimum_words_in_comments, cache_dir=cache_dir, workers=preprocessing_workers, as_ids=True,
+                                              start=None if resume is None else resume['position'], sketch=sketch)
+    # The lemma cache is only reported when the comments are cleaned in this process
+    reported_textprocessor = textProcessor if preprocessing_workers <= 1 else None
+    pipeline(stream, model, dictionary, minimum_word_occurence=minimum_word_count, time_delta=time_delta, time_frames=time_frames, textprocessor=reported_textprocessor,
+             checkpoint_file=checkpoint_file, resume=resume, sketch=sketch)
@@ -0,0 +1,216 @@
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import json
+import threading
+import time
+
+from model import Model
+from similarity import VectorIndex, AnnIndex
+
+class DefinitionService:
+    """
+    Defines words on demand with the newest model of the pipeline, the same
+    way the urban dictionary is filled: the topn most similar words of the
+    dictionary with at least the treshold score.
+
+    The model is memory-mapped read-only. Only the normalized vectors of the
+    dictionary words are copied into memory, 4 * dimensions bytes per word
+    (e.g. 40MB for 100k words of 100 dimensions), and only the rows of the
+    words that are defined are read from the model. Recent definitions are
+    kept in an LRU cache of at most cache_size * topn meanings, which is
+    emptied when the pipeline publishes a new model (see
+    writer.publish_model).
+    """
+    def __init__(self, pointer_file, dictionary, topn=100, treshold=0.6,
+                 cache_size=1000, check_every=1.0, ann_settings=None):
+        """
+        pointer_file: file with the folder of the newest model, e.g.
+                      ../Models/latest
+        dictionary: instance of class Dictionary. Only its words are used as
+                    meanings.
+        topn: maximum number of meanings of a word. Requests can ask for less.
+        treshold: minimum similarity score of a meaning
+        cache_size: number of definitions kept in the LRU cache
+        check_every: number of seconds between two checks for a new model
+        ann_settings: settings of an AnnIndex, see similarity.benchmark_ann.
+                      None to search exactly.
+        """
+        self.pointer_file = pointer_file
+        self.dictionary = dictionary
+        self.topn = topn
+        self.treshold = treshold
+        self.cache_size = cache_size
+        self.check_every = check_every
+        self.ann_settings = ann_settings
+
+        self.lock = threading.Lock()
+        self.loading = threading.Lock()
+        self.model_dir = None
+        self.index = None
+        self.checked = 0.0
+        self.refresh()
+
+    def refresh(self):
+        """
+        return: boolean, True if a new model was loaded
+
+        Load the model the pointer file points to if it changed. Requests
+        are answered with the previous model while the new one is loaded.
+        """
+        # Only one thread loads, the others continue with the current model
+        if not self.loading.acquire(blocking=False):
+            return False
+        try:
+            self.checked = time.time()
+            with open(self.pointer_file, 'r') as inpt:
+                model_dir = inpt.read().strip()
+            if model_dir == self.model_dir:
+                return False
+
+            model = self.load_model(model_dir)
+            if self.ann_settings is not None:
+                index = AnnIndex(model, candidates=self.dictionary.words, **self.ann_settings)
+            else:
+                index = VectorIndex(model, candidates=self.dictionary.words)
+
+            # The cache belongs to the model, so a new model gets a new cache
+            with self.lock:
+                self.index = index
+                self.model_dir = model_dir
+                self.cached_define = lru_cache(maxsize=self.cache_size)(
+                    lambda word: self.search(index, word))
+            return True
+        finally:
+            self.loading.release()
+
+    def load_model(self, model_dir):
+        """
+        model_dir: folder of a saved model
+
+        return: instance of the class Model with memory-mapped arrays
+        """
+        model = Model()
+        model.load(model_dir, mmap='r')
+        return model
+
+    def search(self, index, word):
+        """
+        index: instance of similarity.VectorIndex
+        word: string
+
+        return: list of tuples (meaning, score), most similar first, or None
+                if the word is not in the model
+        """
+        if word not in index.wv.vocab:
+            return None
+        return index.most_similar([word], topn=self.topn, treshold=self.treshold)[word]
+
+    def define(self, word, topn=None):
+        """
+        word: string
+        topn: number of meanings, at most the topn of the service
+
+        return: tuple (model folder, meanings). Meanings is a list of tuples
+                (meaning, score) like UrbanDict.topn_words, or None if the
+                word is not in the model.
+        """
+        if time.time() - self.checked >= self.check_every:
+            self.refresh()
+
+        # Take the cache and model that belong together
+        with self.lock:
+            cached_define, model_dir = self.cached_define, self.model_dir
+        meanings = cached_define(word)
+        if meanings is not None and topn is not None:
+            meanings = meanings[:topn]
+        return model_dir, meanings
+
+    def info(self):
+        """
+        return: dict with the current model and the hits, misses and size of
+                the cache
+        """
+        cache = self.cached_define.cache_info()
+        return {'model': self.model_dir, 'hits': cache.hits,
+                'misses': cache.misses, 'size': cache.currsize}
+
+class DefinitionHandler(BaseHTTPRequestHandler):
+    """
+    GET /define?word=<word>&topn=<number> answers with the definition as json,
+    GET /info with DefinitionService.info. Errors are answered with a json
+    object with an 'error': 400 for a bad request, 500 if the service failed,
+    e.g. while loading a new model.
+    """
+    # Set by serve
+    service = None
+
+    def do_GET(self):
+        try:
+            self.answer()
+        except Exception as error:
+            # E.g. the new model could not be loaded
+            self.respond(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+
+    def answer(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/define' and 'word' in query:
+            topn = None
+            if 'topn' in query:
+                try:
+                    topn = int(query['topn'][0])
+                except ValueError:
+                    topn = 0
+                if topn < 1:
+                    self.respond(400, {'error': 'topn should be a positive integer'})
+                    return
+            model_dir, meanings = self.service.define(query['word'][0], topn=topn)
+            if meanings is None:
+                self.respond(404, {'word': query['word'][0], 'model': model_dir,
+                                   'error': 'word is not in the model'})
+            else:
+                self.respond(200, {'word': query['word'][0], 'model': model_dir,
+                                   'meanings': meanings})
+        elif url.path == '/info':
+            self.respond(200, self.service.info())
+        else:
+            self.respond(400, {'error': 'use /define?word=<word> or /info'})
+
+    def respond(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't print a line for every request
+        pass
+
+def serve(service, host='127.0.0.1', port=8080):
+    """
+    service: instance of DefinitionService
+    host: address to listen on
+    port: port to listen on
+
+    return: ThreadingHTTPServer, call serve_forever on it. Every request is
+            handled in its own thread.
+    """
+    handler = type('Handler', (DefinitionHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+if __name__ == '__main__':
+    import sys
+    from dictionary import CompactDictionary
+    from textprocessor import TextProcessor
+
+    # Usage: python service.py [<port>]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    dictionary = CompactDictionary()
+    dictionary.fill_dict_from_txt('data/words.txt', TextProcessor(fast=True),
+                                  prebuilt='../Cache/words.prebuilt')
+    server = serve(DefinitionService('../Models/latest', dictionary), port=port)
+    print('serving definitions on http://127.0.0.1:{}/define?word=<word>'.format(port))
+    server.serve_forever()
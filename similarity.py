@@ -0,0 +1,346 @@
+import time
+
+import numpy as np
+
+def normalized_vectors(wv):
+    """
+    wv: the word vectors of a gensim Word2Vec model (model.wv)
+
+    return: matrix with the vector of every word in the vocabulary scaled to
+            unit length. Row i belongs to wv.index2word[i].
+    """
+    wv.init_sims()
+    # Renamed in later versions of gensim
+    vectors = getattr(wv, 'vectors_norm', None)
+    if vectors is None:
+        vectors = wv.syn0norm
+    return vectors
+
+def normalize_rows(wv, indexes):
+    """
+    wv: the word vectors of a gensim Word2Vec model (model.wv)
+    indexes: list of rows
+
+    return: matrix with the vectors of the rows scaled to unit length, the
+            same as those rows of normalized_vectors. Only these rows are
+            read, so a memory-mapped model is not copied into memory.
+    """
+    # Renamed in later versions of gensim
+    vectors = getattr(wv, 'vectors', None)
+    if vectors is None:
+        vectors = wv.syn0
+    rows = vectors[indexes]
+    # Computed like init_sims does
+    return (rows / np.sqrt((rows ** 2).sum(-1))[..., np.newaxis]).astype(np.float32)
+
+class VectorIndex:
+    """
+    Exact similarity search for many words at once. The similarities of a
+    chunk of words are computed with one matrix multiplication against the
+    normalized vectors, instead of one most_similar call per word. This gives
+    the same neighbours and scores as gensim's most_similar.
+
+    The search can be restricted to a set of candidate words, e.g. the words
+    of the English dictionary. Only the normalized vectors of those words are
+    kept, and the vectors of the query words are normalized when they are
+    searched. So searching is cheaper, all results are already candidates and
+    the model doesn't need a normalized copy of all its vectors.
+    """
+    def __init__(self, model, candidates=None, chunk_size=128):
+        """
+        model: instance of the class Model. Should be initialized first.
+        candidates: iterable of words. If given, only these words can be
+                    returned as similar words. Words not in the model are
+                    ignored.
+        chunk_size: number of words compared to the candidates at once. A
+                    chunk needs chunk_size * number of candidates floats of
+                    memory.
+        """
+        self.wv = model.model.wv
+        self.chunk_size = chunk_size
+
+        if candidates is None:
+            self.vectors = normalized_vectors(self.wv)
+            self.words = self.wv.index2word
+            self.positions = None
+        else:
+            vocab = self.wv.vocab
+            indexes = sorted(vocab[word].index for word in candidates
+                             if word in vocab)
+            self.vectors = normalize_rows(self.wv, indexes)
+            self.words = [self.wv.index2word[i] for i in indexes]
+            self.positions = {word: i for i, word in enumerate(self.words)}
+
+    def position(self, word):
+        """
+        word: string
+
+        return: row of word in self.vectors, or None if it is not in the index
+        """
+        if self.positions is not None:
+            return self.positions.get(word)
+        vocab = self.wv.vocab.get(word)
+        return None if vocab is None else vocab.index
+
+    def query_vectors(self, words):
+        """
+        words: list of words in the vocabulary of the model
+
+        return: matrix with the normalized vectors of the words
+        """
+        indexes = [self.wv.vocab[word].index for word in words]
+        if self.positions is None:
+            return self.vectors[indexes]
+        return normalize_rows(self.wv, indexes)
+
+    def most_similar(self, words, topn=10, treshold=None):
+        """
+        words: list of words in the vocabulary of the model
+        topn: number of most similar words returned per word
+        treshold: if given, only similar words with at least this score are
+                  returned
+
+        return: dict with for each word a list of tuples (similar word, score),
+                most similar first. A word is never similar to itself.
+        """
+        output = {}
+        for start in range(0, len(words), self.chunk_size):
+            chunk = words[start:start + self.chunk_size]
+            similarities = np.dot(self.query_vectors(chunk), self.vectors.T)
+
+            # A word should not be explained by itself
+            for row, word in enumerate(chunk):
+                position = self.position(word)
+                if position is not None:
+                    similarities[row, position] = -np.inf
+
+            top, top_similarities = self.top(similarities, topn)
+
+            keep = np.isfinite(top_similarities)
+            if treshold is not None:
+                keep &= top_similarities >= treshold
+
+            for row, word in enumerate(chunk):
+                output[word] = [(self.words[i], float(score)) for i, score
+                                in zip(top[row][keep[row]],
+                                       top_similarities[row][keep[row]])]
+        return output
+
+    def top(self, similarities, topn):
+        """
+        similarities: matrix of similarity scores, a row per query word
+        topn: number of best scores to keep per row
+
+        return: tuple of matrices (columns, scores) of the topn best scores per
+                row, best first.
+        """
+        topn = min(topn, similarities.shape[1])
+        if topn < similarities.shape[1]:
+            # Only select the topn best without sorting the whole row
+            top = np.argpartition(-similarities, topn - 1, axis=1)[:, :topn]
+        else:
+            top = np.tile(np.arange(similarities.shape[1]), (similarities.shape[0], 1))
+
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind='stable')
+        return (np.take_along_axis(top, order, axis=1),
+                np.take_along_axis(top_similarities, order, axis=1))
+
+class AnnIndex(VectorIndex):
+    """
+    Approximate similarity search with random projections (locality sensitive
+    hashing). Every table hashes the vectors to a bucket using the signs of
+    their projections on a number of random hyperplanes. Similar vectors tend
+    to end up in the same bucket, so only the words sharing a bucket with the
+    query word in at least one table are compared exactly.
+
+    More tables find more of the true neighbours, more bits per table make the
+    buckets smaller and the search faster. Use recall_at_k to choose.
+    """
+    def __init__(self, model, candidates=None, tables=8, bits=12, probes=0,
+                 seed=1):
+        """
+        model: instance of the class Model. Should be initialized first.
+        candidates: iterable of words, see VectorIndex
+        tables: number of hash tables
+        bits: number of hyperplanes per table
+        probes: number of extra buckets searched per table. These are the
+                buckets where the query vector is closest to the hyperplane.
+        seed: seed for the random hyperplanes
+        """
+        VectorIndex.__init__(self, model, candidates=candidates)
+        self.probes = min(probes, bits)
+
+        random = np.random.RandomState(seed)
+        self.planes = random.randn(tables, bits, self.vectors.shape[1]).astype(self.vectors.dtype)
+        self.powers = 1 << np.arange(bits, dtype=np.int64)
+
+        # For every table, sort the rows by bucket and remember where each
+        # bucket starts in that order
+        self.tables = []
+        for planes in self.planes:
+            codes = self.hash(np.dot(self.vectors, planes.T))
+            order = np.argsort(codes, kind='stable')
+            bucket_codes, starts, counts = np.unique(codes[order],
+                                                     return_index=True,
+                                                     return_counts=True)
+            buckets = dict(zip(bucket_codes.tolist(),
+                               zip(starts.tolist(), counts.tolist())))
+            self.tables.append((order, buckets))
+
+    def hash(self, projections):
+        """
+        projections: matrix of projections on the hyperplanes of one table
+
+        return: array with a bucket code for every row
+        """
+        return np.dot(projections > 0, self.powers)
+
+    def candidate_rows(self, vector):
+        """
+        vector: normalized vector of a query word
+
+        return: array of rows in self.vectors sharing a bucket with the vector
+        """
+        rows = []
+        for planes, (order, buckets) in zip(self.planes, self.tables):
+            projection = np.dot(planes, vector)
+            code = int(np.dot(projection > 0, self.powers))
+            codes = [code]
+
+            # Also look in the buckets on the other side of the closest planes
+            for bit in np.argsort(np.abs(projection))[:self.probes]:
+                codes.append(code ^ int(self.powers[bit]))
+
+            for code in codes:
+                bucket = buckets.get(code)
+                if bucket is not None:
+                    rows.append(order[bucket[0]:bucket[0] + bucket[1]])
+
+        if len(rows) == 0:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(rows))
+
+    def most_similar(self, words, topn=10, treshold=None):
+        """
+        words: list of words in the vocabulary of the model
+        topn: number of most similar words returned per word
+        treshold: if given, only similar words with at least this score are
+                  returned
+
+        return: dict with for each word a list of tuples (similar word, score),
+                most similar first. Scores are exact, but some of the true
+                neighbours can be missing.
+        """
+        output = {}
+        query_vectors = self.query_vectors(words)
+        for word, vector in zip(words, query_vectors):
+            rows = self.candidate_rows(vector)
+
+            # A word should not be explained by itself
+            position = self.position(word)
+            if position is not None:
+                rows = rows[rows != position]
+
+            if len(rows) == 0:
+                output[word] = []
+                continue
+
+            similarities = np.dot(self.vectors[rows], vector)[np.newaxis, :]
+            top, top_similarities = self.top(similarities, topn)
+            top, top_similarities = rows[top[0]], top_similarities[0]
+            if treshold is not None:
+                keep = top_similarities >= treshold
+                top, top_similarities = top[keep], top_similarities[keep]
+
+            output[word] = [(self.words[i], float(score)) for i, score
+                            in zip(top, top_similarities)]
+        return output
+
+def recall_at_k(exact_index, approximate_index, words, k=10):
+    """
+    exact_index: instance of VectorIndex
+    approximate_index: instance of AnnIndex, built on the same model and
+                       candidates
+    words: list of words in the vocabulary of the model to query
+    k: number of neighbours compared
+
+    return: tuple (recall, exact seconds, approximate seconds). recall is the
+            fraction of the exact k nearest neighbours that is also found by
+            the approximate index.
+    """
+    start = time.time()
+    exact = exact_index.most_similar(words, topn=k)
+    exact_time = time.time() - start
+
+    start = time.time()
+    approximate = approximate_index.most_similar(words, topn=k)
+    approximate_time = time.time() - start
+
+    found = 0
+    total = 0
+    for word in words:
+        true_neighbours = set(neighbour for neighbour, _ in exact[word])
+        found += len(true_neighbours.intersection(
+            neighbour for neighbour, _ in approximate[word]))
+        total += len(true_neighbours)
+
+    recall = found / total if total > 0 else 1.0
+    return recall, exact_time, approximate_time
+
+def benchmark_ann(model, words, candidates=None, k=10,
+                  settings=((4, 8), (8, 12), (16, 12), (16, 16))):
+    """
+    model: instance of the class Model. Should be initialized first.
+    words: list of words to query, e.g. the unknown words of the model
+    candidates: iterable of words the search is restricted to, see VectorIndex
+    k: number of neighbours compared
+    settings: tuples (tables, bits) of the approximate indexes to compare
+
+    return: list of dicts with the settings, recall@k, build time and query
+            times of every approximate index
+
+    Compares the approximate indexes with the exact search, so a trade-off
+    between speed and accuracy can be chosen.
+    """
+    exact_index = VectorIndex(model, candidates=candidates)
+    results = []
+    for tables, bits in settings:
+        start = time.time()
+        approximate_index = AnnIndex(model, candidates=candidates,
+                                     tables=tables, bits=bits)
+        build_time = time.time() - start
+
+        recall, exact_time, approximate_time = recall_at_k(exact_index,
+                                                           approximate_index,
+                                                           words, k=k)
+        results.append({'tables': tables, 'bits': bits, 'recall': recall,
+                        'build_seconds': build_time,
+                        'exact_seconds': exact_time,
+                        'approximate_seconds': approximate_time})
+        print('tables {:>3} bits {:>3}: recall@{} {:.3f}, build {:.2f}s, '
+              'query {:.2f}s (exact {:.2f}s)'.format(tables, bits, k, recall,
+                                                     build_time,
+                                                     approximate_time,
+                                                     exact_time))
+    return results
+
+if __name__ == '__main__':
+    import random
+    import sys
+    from dictionary import CompactDictionary
+    from model import Model
+    from textprocessor import TextProcessor
+
+    # Usage: python similarity.py <model folder> [number of query words]
+    # The queries are a sample of the unknown words of the model, searched
+    # among the words of the dictionary, like the pipeline does.
+    model = Model()
+    model.load(sys.argv[1])
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    dictionary = CompactDictionary()
+    dictionary.fill_dict_from_txt('data/words.txt', TextProcessor(fast=True),
+                                  prebuilt='../Cache/words.prebuilt')
+    unknown = model.unknown_words(dictionary, min_occurence=1)
+    words = random.Random(0).sample(unknown, min(number, len(unknown)))
+    benchmark_ann(model, words, candidates=dictionary.words)
@@ -0,0 +1,152 @@
+from collections import Counter
+import heapq
+
+class HeavyHitters:
+    """
+    Space-Saving summary of the most frequent words of a stream in fixed
+    memory. At most capacity words are counted. When a new word arrives and
+    the summary is full, it replaces the word with the lowest count and
+    inherits that count as its possible overestimation (error). Every word
+    occuring more than total / capacity times is guaranteed to be counted.
+    """
+    def __init__(self, capacity=1000):
+        """
+        capacity: maximum number of words counted
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # Heap of (count, word), entries with an old count are skipped
+        self.heap = []
+
+    def add(self, word, weight=1):
+        """
+        word: string
+        weight: number of occurences
+        """
+        self.total += weight
+        counts = self.counts
+        if word in counts:
+            counts[word] += weight
+        elif len(counts) < self.capacity:
+            counts[word] = weight
+            self.errors[word] = 0
+        else:
+            # Find the word with the lowest count, skipping outdated entries
+            while True:
+                count, smallest = heapq.heappop(self.heap)
+                if counts.get(smallest) == count:
+                    break
+            del counts[smallest]
+            del self.errors[smallest]
+            counts[word] = count + weight
+            self.errors[word] = count
+        heapq.heappush(self.heap, (counts[word], word))
+
+        # Outdated entries are only removed when popped, so rebuild the heap
+        # once in a while to keep the memory fixed
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, word) for word, count in counts.items()]
+            heapq.heapify(self.heap)
+
+    def update(self, counts):
+        """
+        counts: dict with words and their number of occurences, e.g. of a
+                batch. Largest counts are added first, so frequent words of
+                the batch are not pushed out by rare ones.
+        """
+        for word, count in sorted(counts.items(), key=lambda item: -item[1]):
+            self.add(word, count)
+
+    def count(self, word):
+        """
+        return: estimated count of the word, at most its error too high. 0 if
+                the word is not counted.
+        """
+        return self.counts.get(word, 0)
+
+    def top(self, n=100):
+        """
+        return: list of tuples (word, count, error) of the n words with the
+                highest count, highest first
+        """
+        top = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+        return [(word, count, self.errors[word]) for word, count in top]
+
+class SlangSketch:
+    """
+    Tracks the words unknown by a dictionary in a stream of batches, in fixed
+    memory per time window. The counts of the current window are compared to
+    the window before it, giving the growth rate of every heavy hitter.
+    """
+    def __init__(self, dictionary, capacity=1000, window_batches=1):
+        """
+        dictionary: instance of class Dictionary. Its words are not tracked.
+        capacity: maximum number of words counted per window
+        window_batches: number of batches in one time window
+        """
+        self.dictionary = dictionary
+        self.capacity = capacity
+        self.window_batches = window_batches
+        self.current = HeavyHitters(capacity)
+        self.previous = HeavyHitters(capacity)
+        self.batches = 0
+
+    def add_batch(self, batch):
+        """
+        batch: dict with a batch of words or token ids, see
+               helpers.create_batches
+        """
+        if 'ids' in batch:
+            # Count the token ids, and only look up the distinct ones
+            vocabulary = batch['vocabulary']
+            known = vocabulary.known_mask(self.dictionary)
+            counts = {vocabulary.words[token_id]: count
+                      for token_id, count in Counter(batch['ids']).items()
+                      if not known[token_id]}
+            self.add_counts(counts)
+        else:
+            self.add_comments(batch['comments'])
+
+    def add_comments(self, comments):
+        """
+        comments: list of comments of a batch. Comment being a list of words.
+        """
+        counts = Counter(word for comment in comments for word in comment)
+        self.add_counts({word: count for word, count in counts.items()
+                         if not self.dictionary.check_word(word)})
+
+    def add_counts(self, counts):
+        """
+        counts: dict with the unknown words of a batch and their counts
+
+        Start a new window first if the current one is complete.
+        """
+        if self.batches > 0 and self.batches % self.window_batches == 0:
+            self.previous = self.current
+            self.current = HeavyHitters(self.capacity)
+        self.batches += 1
+        self.current.update(counts)
+
+    def growth(self, word):
+        """
+        return: count of the word in the current window divided by its count
+                in the previous window. None for a word that is new, so the
+                growth can be written as json.
+        """
+        previous = self.previous.count(word)
+        if previous == 0:
+            return None if self.current.count(word) > 0 else 0.0
+        return self.current.count(word) / previous
+
+    def heavy_hitters(self, n=100, min_count=1):
+        """
+        n: maximum number of words
+        min_count: minimum count in the current window
+
+        return: list of tuples (word, count, growth) of the most frequent
+                unknown words of the current window, most frequent first
+        """
+        return [(word, count, self.growth(word))
+                for word, count, _ in self.current.top(n) if count >= min_count]
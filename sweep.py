@@ -0,0 +1,197 @@
+from collections import OrderedDict
+from datetime import datetime
+from itertools import product
+from multiprocessing import Pool
+import json
+import os
+
+import helpers
+from model import Model
+from pipeline import pipeline
+from urbanlog import read_urban_dict
+
+def configurations(grid):
+    """
+    grid: dict with a list of values for every parameter of pipeline, e.g.
+          {'time_delta': [12, 24], 'time_frames': [5, 7],
+           'incremental_settings': [None, {'snapshot_every': 24}]}
+
+    return: list of dicts, one for every combination of values
+    """
+    names = sorted(grid)
+    return [OrderedDict(zip(names, values))
+            for values in product(*(grid[name] for name in names))]
+
+def configuration_name(configuration):
+    """
+    return: name of the output folder of a configuration
+    """
+    return '-'.join('{}={}'.format(name, value_name(value)) for name, value in configuration.items())
+
+def value_name(value):
+    """
+    return: value of a parameter as used in the name of a configuration.
+            Settings like {'tolerance': 0.05} become tolerance:0.05.
+    """
+    if isinstance(value, dict):
+        return ','.join('{}:{}'.format(name, value[name]) for name in sorted(value))
+    return str(value)
+
+def prepare(files, textprocessor, cache_dir, model_dir, snapshot_dir, workers=1):
+    """
+    files: update files of the sweep
+    textprocessor: the TextProcessor of the sweep
+    cache_dir: folder of the CorpusCache
+    model_dir: folder with the initialized model, saved by Model.save
+    snapshot_dir: folder to snapshot the model in
+
+    return: folder of the snapshot of the model
+
+    Parse and clean all files once into the cache, and snapshot the model
+    once, so all configurations share them.
+    """
+    for _ in helpers.create_stream_from_files(files, textprocessor, cache_dir=cache_dir,
+                                              workers=workers):
+        pass
+
+    model = Model()
+    model.load(model_dir)
+    model.snapshot(snapshot_dir)
+    return snapshot_dir
+
+# Settings shared by all configurations of a sweep, set by _init_sweep_worker
+_sweep_settings = None
+
+def _init_sweep_worker(settings):
+    global _sweep_settings
+    _sweep_settings = settings
+
+def run_configuration(configuration):
+    """
+    configuration: dict with parameters of pipeline
+
+    return: dict with the configuration, its duration and output folder
+
+    Runs the pipeline on the cached files with the shared snapshot, writing
+    all output in its own folder.
+    """
+    settings = _sweep_settings
+    output_dir = os.path.join(settings['sweep_dir'], configuration_name(configuration))
+    time_delta = configuration.get('time_delta', 12)
+
+    model = Model()
+    model.load_snapshot(settings['snapshot_dir'])
+    stream = helpers.create_stream_from_files(settings['files'], settings['textprocessor'],
+                                              time_delta=time_delta,
+                                              minimum_words=settings['minimum_words'],
+                                              cache_dir=settings['cache_dir'], as_ids=True)
+
+    start = datetime.now()
+    pipeline(stream, model, settings['dictionary'], snapshot_dir=None,
+             metrics_file=os.path.join(output_dir, 'metrics.jsonl'),
+             window_dir=os.path.join(output_dir, 'Window'), output_dir=output_dir,
+             textprocessor=settings['textprocessor'], **configuration)
+    return {'configuration': dict(configuration), 'output_dir': output_dir,
+            'seconds': (datetime.now() - start).total_seconds()}
+
+def summarize(result):
+    """
+    result: dict returned by run_configuration
+
+    return: the result with the seconds spent per stage, summed over all
+            batches, and the number of words in the last urban dict
+    """
+    spans = {}
+    batches = 0
+    with open(os.path.join(result['output_dir'], 'metrics.jsonl'), 'r') as inpt:
+        for line in inpt:
+            summary = json.loads(line)
+            if summary['batch'] not in ('start', 'end'):
+                batches += 1
+            for name, span in summary['spans'].items():
+                spans[name] = spans.get(name, 0.0) + span['seconds']
+    result['batches'] = batches
+    result['stages'] = spans
+    urban_dir = os.path.join(result['output_dir'], 'Urban_Dicts')
+    if result['configuration'].get('incremental_settings') is not None:
+        try:
+            result['urban_dict'] = read_urban_dict(urban_dir)
+        except ValueError:
+            result['urban_dict'] = {}
+    else:
+        # A complete urban dict per batch, named after the date of the batch
+        dates = sorted(os.listdir(urban_dir))
+        result['urban_dict'] = {}
+        if len(dates) > 0:
+            with open(os.path.join(urban_dir, dates[-1]), 'r') as inpt:
+                result['urban_dict'] = json.load(inpt)
+    result['words_defined'] = len(result['urban_dict'])
+    return result
+
+def sweep(grid, files, textprocessor, dictionary, model_dir, sweep_dir='../Sweep',
+          cache_dir='../Cache', minimum_words=20, workers=2):
+    """
+    grid: see configurations
+    files: update files
+    textprocessor: an instance of the class TextProcessor.
+    dictionary: instance of class Dictionary
+    model_dir: folder of the initialized model
+    sweep_dir: folder for the output of all configurations and the report
+    cache_dir: folder of the CorpusCache
+    minimum_words: minimum words in a comment
+    workers: number of configurations run at the same time, each in its own
+             process
+
+    return: report, a list of summaries (see summarize), fastest first. Also
+            written to <sweep_dir>/report.json.
+
+    The files are cleaned once and the model is snapshotted once. Every
+    process memory-maps the same snapshot and cache, so they share pages.
+    """
+    if not os.path.isdir(sweep_dir):
+        os.makedirs(sweep_dir)
+    snapshot_dir = prepare(files, textprocessor, cache_dir, model_dir,
+                           os.path.join(sweep_dir, 'Base'), workers=workers)
+    settings = {'sweep_dir': sweep_dir, 'snapshot_dir': snapshot_dir, 'files': files,
+                'textprocessor': textprocessor, 'dictionary': dictionary,
+                'cache_dir': cache_dir, 'minimum_words': minimum_words}
+
+    # Every process only runs one configuration, so gensim and the pipeline
+    # start clean
+    with Pool(workers, initializer=_init_sweep_worker, initargs=(settings,),
+              maxtasksperchild=1) as pool:
+        results = pool.map(run_configuration, configurations(grid), chunksize=1)
+
+    report = sorted((summarize(result) for result in results), key=lambda result: result['seconds'])
+    reference = set(report[0]['urban_dict']) if len(report) > 0 else set()
+    for result in report:
+        # Overlap of the defined words with the fastest configuration
+        words = set(result.pop('urban_dict'))
+        union = words | reference
+        result['overlap_with_fastest'] = len(words & reference) / len(union) if len(union) > 0 else 1.0
+
+    with open(os.path.join(sweep_dir, 'report.json'), 'w') as outpt:
+        json.dump(report, outpt, indent='\t')
+    return report
+
+if __name__ == '__main__':
+    from dictionary import CompactDictionary
+    from textprocessor import TextProcessor
+
+    update_stream_files = ['../Data/01-{:02d}.txt'.format(day) for day in range(15, 32)]
+    grid = {'time_delta': [12, 24],
+            'time_frames': [5, 7],
+            'minimum_word_occurence': [50, 100],
+            'meaning_score_treshold': [0.6],
+            'incremental_settings': [{'snapshot_every': 24}]}
+
+    textProcessor = TextProcessor(fast=True)
+    dictionary = CompactDictionary()
+    dictionary.fill_dict_from_txt('data/words.txt', textProcessor, prebuilt='../Cache/words.prebuilt')
+
+    report = sweep(grid, update_stream_files, textProcessor, dictionary, '../Models/Init',
+                   workers=max(1, os.cpu_count() // 2))
+    for result in report:
+        print('{:>8.0f}s {:>6} words {:>5.2f} overlap {}'.format(
+            result['seconds'], result['words_defined'], result['overlap_with_fastest'],
+            configuration_name(result['configuration'])))
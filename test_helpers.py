@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+import json
+import random
+
+import pytest
+
+import helpers
+
+class SplitProcessor:
+    """
+    Stands in for TextProcessor: lowercase words split on whitespace.
+    """
+    def fingerprint(self):
+        return 'split'
+
+    def clean_text(self, text):
+        return text.lower().split()
+
+def baseline_batches(files, textprocessor, time_delta=12, minimum_words=20):
+    """
+    The batching of the original create_stream_from_files, which the stream
+    should still reproduce.
+    """
+    batch = []
+    starting_line = True
+    for fle in files:
+        with open(fle, 'r') as inpt:
+            for line in inpt:
+                text = json.loads(line)
+                if '*[I am a bot]' in text['body']:
+                    continue
+                date = datetime.fromtimestamp(text['created_utc'])
+                if starting_line:
+                    current_date = date
+                    batch = {'date': current_date.strftime('%Y-%m-%d %H:%M'), 'comments': []}
+                    starting_line = False
+                text = textprocessor.clean_text(text['body'])
+                if date - current_date < timedelta(hours=time_delta):
+                    if len(text) >= minimum_words:
+                        batch['comments'].append(text)
+                else:
+                    current_date = date
+                    yield batch
+                    batch = {'date': current_date.strftime('%Y-%m-%d %H:%M'), 'comments': [text]}
+    if len(batch) > 0:
+        yield batch
+
+def write_comments(fle, number, start, seed):
+    """
+    Comments of 0 to 8 words, some seconds to hours apart, with a few bot
+    comments, so batches often start with a short comment.
+    """
+    random_generator = random.Random(seed)
+    created_utc = start
+    with open(fle, 'w') as outpt:
+        for number_comment in range(number):
+            created_utc += random_generator.choice([1, 60, 600, 3600, 4 * 3600])
+            body = ' '.join(random_generator.choice('abcdefgh')
+                            for _ in range(random_generator.randint(0, 8)))
+            if number_comment % 37 == 0:
+                body += ' *[I am a bot]'
+            outpt.write(json.dumps({'body': body, 'created_utc': created_utc}) + '\n')
+    return created_utc
+
+@pytest.fixture
+def files(tmpdir):
+    files = []
+    created_utc = 1420070400
+    for number in range(3):
+        fle = str(tmpdir.join('comments-{}.txt'.format(number)))
+        created_utc = write_comments(fle, 300, created_utc, seed=number)
+        files.append(fle)
+    return files
+
+@pytest.mark.parametrize('as_ids', [False, True])
+@pytest.mark.parametrize('cached', [False, True])
+def test_stream_matches_baseline_batches(files, tmpdir, as_ids, cached):
+    textprocessor = SplitProcessor()
+    cache_dir = str(tmpdir.join('cache')) if cached else None
+    for minimum_words in (1, 3, 6):
+        expected = [(batch['date'], batch['comments']) for batch
+                    in baseline_batches(files, textprocessor, time_delta=1,
+                                        minimum_words=minimum_words)]
+        # Twice, to read from the cache the second time
+        for _ in range(2):
+            stream = helpers.create_stream_from_files(files, textprocessor, time_delta=1,
+                                                      minimum_words=minimum_words,
+                                                      cache_dir=cache_dir, as_ids=as_ids)
+            assert [(batch['date'], helpers.batch_sentences(batch))
+                    for batch in stream] == expected
+
+def test_count_words_counts_the_trained_comments(files):
+    textprocessor = SplitProcessor()
+    for minimum_words in (1, 3, 6):
+        batches = list(baseline_batches(files, textprocessor, time_delta=1,
+                                        minimum_words=minimum_words))
+        counts, comments = helpers.count_words(files, textprocessor, time_delta=1,
+                                               minimum_words=minimum_words)
+        assert comments == sum(len(batch['comments']) for batch in batches)
+        assert sum(counts.values()) == sum(len(comment) for batch in batches
+                                           for comment in batch['comments'])
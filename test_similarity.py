@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from similarity import VectorIndex
+
+class Vocab:
+    def __init__(self, index):
+        self.index = index
+
+class KeyedVectors:
+    """
+    The parts of gensim 3's KeyedVectors used by VectorIndex, with
+    most_similar computed like gensim does it for a single word.
+    """
+    def __init__(self, words, dimensions, seed=0):
+        random = np.random.RandomState(seed)
+        self.vectors = random.randn(words, dimensions).astype(np.float32)
+        self.index2word = ['word{}'.format(i) for i in range(words)]
+        self.vocab = {word: Vocab(i) for i, word in enumerate(self.index2word)}
+        self.vectors_norm = None
+
+    def init_sims(self):
+        if self.vectors_norm is None:
+            self.vectors_norm = self.vectors / np.linalg.norm(self.vectors, axis=1,
+                                                              keepdims=True)
+
+    def most_similar(self, word, topn=10):
+        self.init_sims()
+        index = self.vocab[word].index
+        similarities = np.dot(self.vectors_norm, self.vectors_norm[index])
+        best = np.argsort(-similarities)[:topn + 1]
+        return [(self.index2word[i], float(similarities[i]))
+                for i in best if i != index][:topn]
+
+class Model:
+    def __init__(self, wv):
+        self.model = type('Word2Vec', (), {})()
+        self.model.wv = wv
+
+def fake_model():
+    return Model(KeyedVectors(2000, 32))
+
+def gensim_model():
+    gensim = pytest.importorskip('gensim')
+    if int(gensim.__version__.split('.')[0]) >= 4:
+        pytest.skip('VectorIndex uses the gensim 3 vocabulary')
+    random = np.random.RandomState(0)
+    words = ['word{}'.format(i) for i in range(500)]
+    sentences = [list(random.choice(words, 20)) for _ in range(2000)]
+    model = Model(None)
+    model.model = gensim.models.Word2Vec(sentences, min_count=1, workers=1, seed=1)
+    return model
+
+def assert_same_neighbours(batched, expected):
+    assert [word for word, _ in batched] == [word for word, _ in expected]
+    np.testing.assert_allclose([score for _, score in batched],
+                               [score for _, score in expected], rtol=1e-4, atol=1e-5)
+
+@pytest.mark.parametrize('create_model', [fake_model, gensim_model])
+def test_batched_search_matches_most_similar(create_model):
+    model = create_model()
+    wv = model.model.wv
+    words = wv.index2word[::7]
+    index = VectorIndex(model, chunk_size=16)
+
+    output = index.most_similar(words, topn=10)
+    for word in words:
+        assert_same_neighbours(output[word], wv.most_similar(word, topn=10))
+
+@pytest.mark.parametrize('create_model', [fake_model, gensim_model])
+def test_candidate_search_matches_filtered_most_similar(create_model):
+    model = create_model()
+    wv = model.model.wv
+    words = wv.index2word[::11]
+    candidates = set(wv.index2word[::3])
+    index = VectorIndex(model, candidates=candidates, chunk_size=16)
+
+    output = index.most_similar(words, topn=5)
+    for word in words:
+        expected = [(similar, score) for similar, score
+                    in wv.most_similar(word, topn=len(wv.index2word))
+                    if similar in candidates][:5]
+        assert_same_neighbours(output[word], expected)
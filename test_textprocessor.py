@@ -0,0 +1,42 @@
+import random
+
+from textprocessor import TextProcessor
+
+class StubLemmatizer:
+    """
+    Stands in for WordNetLemmatizer, so the tests run without the WordNet
+    data of nltk.
+    """
+    def lemmatize(self, word):
+        if word.endswith('ies'):
+            return word[:-3] + 'y'
+        if word.endswith('s') and not word.endswith('ss'):
+            return word[:-1]
+        return word
+
+SAMPLE_COMMENTS = [
+    "Don't you think the cats are better than dogs? http://example.com/x",
+    'I paid $100 for 2 tickets... worth it!!! www.reddit.com/r/all',
+    'the new-new-- thing (yes) is [deleted] ^^ lol\n\tso many replies',
+    'R&D at #1 company_name, e.g. U.S. policies and 3.5 stories',
+    'Café naïve – “quotes” and emoji 👍 mixed with ASCII words',
+    '',
+]
+
+def random_comments(number, seed=0):
+    random_generator = random.Random(seed)
+    characters = 'abcdefghijklmnopqrsXYZ0123456789 $-_&.#,/\'().\n\t\r^[]!"?é'
+    return [''.join(random_generator.choice(characters)
+                    for _ in range(random_generator.randint(0, 80)))
+            for _ in range(number)]
+
+def processors():
+    slow, fast = TextProcessor(), TextProcessor(fast=True)
+    slow._lemmatizer = StubLemmatizer()
+    fast._lemmatizer = StubLemmatizer()
+    return slow, fast
+
+def test_fast_mode_same_tokens():
+    slow, fast = processors()
+    for comment in SAMPLE_COMMENTS + random_comments(2000):
+        assert fast.clean_text(comment) == slow.clean_text(comment)
@@ -1,16 +1,41 @@
-from nltk.tokenize import word_tokenize, RegexpTokenizer
-from nltk.corpus import stopwords
-from nltk.stem.porter import PorterStemmer
-from nltk.stem import WordNetLemmatizer
+from functools import lru_cache
+import hashlib
+import os
 import re
 
+# nltk is imported on first use of the tokenizer, stopwords, stemmer or
+# lemmatizer, importing it takes about a second
+
+# Increase whenever the output of clean_text changes, so caches of preprocessed
+# text get invalidated.
+PREPROCESSING_VERSION = 1
+
+# Pattern of the words kept by the tokenizer
+TOKEN_PATTERN = r'\b[a-zA-Z0-9$\-_&\.#]+\b'
+
+# Patterns of remove_urls and tokenize, compiled once for the fast mode. The
+# fast mode finds the tokens itself, with the flags of nltk's RegexpTokenizer.
+TOKEN_REGEX = re.compile(TOKEN_PATTERN, re.UNICODE | re.MULTILINE | re.DOTALL)
+URL_PATTERNS = [re.compile(r'http(\S)*'), re.compile(r'www.(\S)*')]
+NUMBER_PATTERN = re.compile(r'[0-9]+')
+DASH_PATTERN = re.compile(r'[-]+')
+# Characters removed by tokenize, removed in one pass with str.translate
+STRIP_TABLE = str.maketrans('', '', ',/\'().\n\t\r^[]!"')
+
 class TextProcessor:
     """
     Basic class for processing text. Make sure to always process text with the
     same processor before feeding it to a model.
     """
-    def __init__(self):
+    def __init__(self, fast=False, lemma_cache_size=100000):
         """
+        fast: use the high-throughput version of clean_text. Its output is the
+              same, but the regexes are compiled once, the characters are
+              stripped in a single pass and lemmas are cached.
+        lemma_cache_size: maximum number of lemmas kept in the cache of the
+                          fast mode (least recently used are dropped first).
+                          None for an unbounded cache.
+
         Set basic preprocessing rules so the same preprocessing is done when
         an instance of this class is used.
         """
@@ -18,10 +43,101 @@ class TextProcessor:
         #self.remove_stopwords = remove_stopwords
         # RegexpTokenizer could be used as tokenizer, or we write our own.
         # RegexpTokenizer has some flaws which could be bad for our model.
-        self.tokenizer = RegexpTokenizer(r'\b[a-zA-Z0-9$\-_&\.#]+\b')
-        self.stopwords = set(stopwords.words('english'))
-        self.stemmer = PorterStemmer()
-        self.lemmatizer = WordNetLemmatizer()
+        # The nltk resources are loaded on first use, see the properties below.
+        self._tokenizer = None
+        self._stopwords = None
+        self._stemmer = None
+        self._lemmatizer = None
+        self.fast = fast
+        self.lemma_cache_size = lemma_cache_size
+        # Lemmas read from a prebuilt file, see load_lemmas
+        self.lemmas = {}
+        self.create_lemma_cache()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from nltk.tokenize import RegexpTokenizer
+            self._tokenizer = RegexpTokenizer(TOKEN_PATTERN)
+        return self._tokenizer
+
+    @property
+    def stopwords(self):
+        if self._stopwords is None:
+            from nltk.corpus import stopwords
+            self._stopwords = set(stopwords.words('english'))
+        return self._stopwords
+
+    @property
+    def stemmer(self):
+        if self._stemmer is None:
+            from nltk.stem.porter import PorterStemmer
+            self._stemmer = PorterStemmer()
+        return self._stemmer
+
+    @property
+    def lemmatizer(self):
+        if self._lemmatizer is None:
+            from nltk.stem import WordNetLemmatizer
+            self._lemmatizer = WordNetLemmatizer()
+        return self._lemmatizer
+
+    def create_lemma_cache(self):
+        """
+        Create the cache of lemmas used by the fast mode.
+        """
+        self.cached_lemmatize = lru_cache(maxsize=self.lemma_cache_size)(self.lemmatize_word)
+
+    def lemma_cache_info(self):
+        """
+        output: named tuple with hits, misses, maxsize and currsize of the
+                lemma cache
+
+        The hit rate is hits / (hits + misses).
+        """
+        return self.cached_lemmatize.cache_info()
+
+    def report(self, metrics):
+        """
+        metrics: instance of instrumentation.Instruments
+
+        Report the state of the lemma cache of the fast mode as gauges.
+        Nothing is reported if this processor didn't clean any text, e.g.
+        when the comments are cleaned by a process pool, which has its own
+        copies of the processor.
+        """
+        info = self.lemma_cache_info()
+        lookups = info.hits + info.misses
+        if lookups == 0:
+            return
+        metrics.gauge('textprocessor.lemma_cache_size', info.currsize)
+        metrics.gauge('textprocessor.lemma_cache_hit_rate', info.hits / lookups)
+
+    def __getstate__(self):
+        # The cache can't be pickled, e.g. when sending the processor to the
+        # processes of a pool. Every copy gets its own cache, and loads the
+        # nltk resources it uses itself.
+        state = self.__dict__.copy()
+        del state['cached_lemmatize']
+        for name in ('_tokenizer', '_stopwords', '_stemmer', '_lemmatizer'):
+            state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.create_lemma_cache()
+
+    def fingerprint(self):
+        """
+        output: string, hash of the preprocessing settings
+
+        Two processors with the same fingerprint produce the same output, so
+        it can be used to check whether cached preprocessed text is still
+        valid.
+        """
+        settings = [str(PREPROCESSING_VERSION), type(self).__name__,
+                    TOKEN_PATTERN]
+        return hashlib.sha1('\n'.join(settings).encode('utf-8')).hexdigest()[:16]
 
     def clean_text(self, text):
         """
@@ -34,6 +150,9 @@ class TextProcessor:
 
         # Remove urls and only keep alphabatical characters and numbers
         # Transform to array of words
+        if self.fast:
+            return self.fast_clean_text(text)
+
         text = self.remove_urls(text)
         tokenized_words = self.tokenize(text)
         # words = self.lemmatize_words(tokenized_words)
@@ -46,6 +165,91 @@ class TextProcessor:
 
         return tokenized_words
 
+    def fast_clean_text(self, text):
+        """
+        text: string of text
+        output: list of lowercase words, the same as clean_text
+        """
+        lemmas = self.lemmas
+        lemmatize = self.cached_lemmatize
+        return [lemmas.get(word) or lemmatize(word) for word in self.fast_tokenize(text)]
+
+    def fast_tokenize(self, text):
+        """
+        text: string of text
+        output: list of lowercase words before lemmatizing
+        """
+        for pattern in URL_PATTERNS:
+            text = pattern.sub('', text)
+
+        text = text.translate(STRIP_TABLE)
+        text = NUMBER_PATTERN.sub('#', text)
+        text = DASH_PATTERN.sub('-', text)
+        text = text.rstrip()
+
+        return [word.lower() for word in TOKEN_REGEX.findall(text)]
+
+    def lemmas_header(self):
+        """
+        return: first line of a prebuilt lemmas file, identifying the
+                preprocessing
+        """
+        return '# {}'.format(self.fingerprint())
+
+    def save_lemmas(self, prebuilt, words):
+        """
+        prebuilt: path of the prebuilt file
+        words: iterable of lowercase words, e.g. the lines of the dictionary
+               file and the most common words of the comments split with
+               fast_tokenize
+
+        Store the lemmas of the words, so they can be loaded with load_lemmas
+        without loading WordNet.
+        """
+        lemmas = {}
+        for word in words:
+            if len(word) > 0 and '\t' not in word and '\n' not in word:
+                lemmas[word] = self.lemmatize_word(word)
+
+        dir_path = os.path.dirname(prebuilt)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        with open(prebuilt + '.tmp', 'w', encoding='utf-8') as outpt:
+            outpt.write(self.lemmas_header() + '\n')
+            outpt.write('\n'.join('{}\t{}'.format(word, lemma)
+                                  for word, lemma in sorted(lemmas.items())))
+        os.replace(prebuilt + '.tmp', prebuilt)
+        self.lemmas.update(lemmas)
+
+    def load_lemmas(self, prebuilt):
+        """
+        prebuilt: path of the prebuilt file
+        return: boolean, False if there is no prebuilt file for this
+                preprocessing
+
+        Read the lemmas stored by save_lemmas with a single read. The fast
+        mode looks words up in them before lemmatizing, so WordNet is only
+        loaded for words that are not in the file.
+        """
+        if not os.path.isfile(prebuilt):
+            return False
+        with open(prebuilt, 'r', encoding='utf-8') as inpt:
+            lines = inpt.read().split('\n')
+        if lines[0] != self.lemmas_header():
+            return False
+        self.lemmas.update(line.split('\t', 1) for line in lines[1:] if len(line) > 0)
+        return True
+
+    def lemmatize_word(self, word):
+        """
+        word: lowercase word
+        output: lemma of the word, or the word itself if lemmatizing fails
+        """
+        try:
+            return self.lemmatizer.lemmatize(word)
+        except RecursionError:
+            return word
+
     def remove_urls(self, text):
         """
         text: string of text
@@ -62,7 +266,7 @@ class TextProcessor:
         text: string of text
         output: array of words
         """
-        lemmatizer = WordNetLemmatizer()
+        lemmatizer = self.lemmatizer
 
         # First regex is to keep abbreviations together
         # Second te remove numbers not surrounded by text
@@ -94,7 +298,7 @@ class TextProcessor:
         words: array of words
         output: array of words
         """
-        stemmer = PorterStemmer()
+        stemmer = self.stemmer
         stemmed_words = []
         for word in words:
             # Try to stem except with error, then just add word
@@ -110,7 +314,7 @@ class TextProcessor:
         words: array of words
         output: array of words
         """
-        lemmatizer = WordNetLemmatizer()
+        lemmatizer = self.lemmatizer
         lemmatized_words = []
         for word in words:
             # Try to lemmatize except with error, then just add word
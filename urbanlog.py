@@ -0,0 +1,92 @@
+import json
+import os
+
+# Suffixes of the files of a log, see UrbanDictLog
+FULL = '.full.json'
+DIFF = '.diff.json'
+
+class UrbanDictLog:
+    """
+    Writes the urban dictionary of every batch as the difference with the
+    batch before, with a full snapshot once every snapshot_every batches. The
+    dictionary of any batch can be read again with read_urban_dict.
+
+    Files are named after the date of the batch, <date>.full.json for a
+    snapshot and <date>.diff.json for a diff (see
+    IncrementalUrbanDict.update), and are written without indentation.
+    """
+    def __init__(self, directory, writer, snapshot_every=24):
+        """
+        directory: folder to write the files to
+        writer: instance of writer.BackgroundWriter
+        snapshot_every: number of batches between two full snapshots. The
+                        first batch written is always a snapshot.
+        """
+        self.directory = directory
+        self.writer = writer
+        self.snapshot_every = snapshot_every
+        self.steps = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, date, urban, diff):
+        """
+        date: date of the batch
+        urban: instance of IncrementalUrbanDict after the update of the batch
+        diff: dict returned by the update
+
+        return: Future of the write
+        """
+        path = os.path.join(self.directory, str(date))
+        if self.steps % self.snapshot_every == 0:
+            # The meanings are replaced on an update, never changed, so a
+            # shallow copy stays the same until it is written
+            future = self.writer.dump_json(dict(urban.words), path + FULL,
+                                           separators=(',', ':'))
+        else:
+            future = self.writer.dump_json(diff, path + DIFF, separators=(',', ':'))
+        self.steps += 1
+        return future
+
+def log_dates(directory):
+    """
+    directory: folder of an UrbanDictLog
+
+    return: sorted list of tuples (date, suffix) of all files in the folder
+    """
+    dates = []
+    for fle in os.listdir(directory):
+        for suffix in (FULL, DIFF):
+            if fle.endswith(suffix):
+                dates.append((fle[:-len(suffix)], suffix))
+    return sorted(dates)
+
+def read_urban_dict(directory, date=None):
+    """
+    directory: folder of an UrbanDictLog
+    date: date of a batch, the last batch if None
+
+    return: dict with the urban dictionary of the batch, like
+            UrbanDict.words. Meanings are lists [word, score].
+
+    Starts from the last full snapshot at or before the date and applies
+    the diffs after it.
+    """
+    dates = [(logged, suffix) for logged, suffix in log_dates(directory)
+             if date is None or logged <= str(date)]
+    snapshots = [i for i, (_, suffix) in enumerate(dates) if suffix == FULL]
+    if len(snapshots) == 0:
+        raise ValueError('no snapshot at or before {} in {}'.format(date, directory))
+
+    words = {}
+    for logged, suffix in dates[snapshots[-1]:]:
+        with open(os.path.join(directory, logged + suffix), 'r') as inpt:
+            content = json.load(inpt)
+        if suffix == FULL:
+            words = content
+        else:
+            for word in content['removed']:
+                words.pop(word, None)
+            words.update(content['added'])
+            words.update(content['changed'])
+    return words
@@ -0,0 +1,161 @@
+from collections import deque
+from datetime import datetime, timedelta
+
+from helpers import batch_sentences
+
+class SlidingWindow:
+    """
+    Keeps the batches of the current time window in memory, so the pipeline
+    does not have to re-read and re-train every file in ../Database on every
+    new batch.
+
+    Word2Vec training can't be undone, so a batch that falls out of the window
+    can only really be removed by starting again from the base model and
+    replaying the batches that are still in the window. Instead of doing that
+    on every batch, the window only replays once every rebuild_every batches.
+    In between, the new batch is trained on top of the current model and the
+    expired batch is simply dropped from memory. This makes the cost of a
+    single step about the cost of training one batch.
+
+    With a WindowStore, the batches are written to the store and only their
+    dates are kept in memory. A rebuild reads them back one at a time.
+    """
+    def __init__(self, base_model, time_frames=7, rebuild_every=None, store=None,
+                 writer=None):
+        """
+        base_model: instance of the class Model. The model every rebuild
+                    starts from. It is never trained itself. Make a snapshot
+                    of it first, so copies of it are cheap.
+        time_frames: number of batches in the window, including the new one.
+        rebuild_every: number of batches after which the model is rebuilt
+                       from the base model and the batches in the window.
+                       Defaults to time_frames. Use 1 to rebuild on every
+                       batch, which is what the pipeline used to do.
+        store: instance of windowstore.WindowStore. If given, new batches are
+               appended to it. Expired batches are not removed from it, that
+               is up to the caller, see step.
+        writer: instance of writer.BackgroundWriter to append the batches to
+                the store with, so compressing and writing them is not done
+                before training. Writes submitted later, e.g. a checkpoint,
+                are done after the append.
+        """
+        self.base_model = base_model
+        self.time_frames = time_frames
+        self.rebuild_every = rebuild_every or time_frames
+        self.store = store
+        self.writer = writer
+        # Future of the last append to the store by the writer
+        self.appended = None
+        self.batches = deque()
+        self.model = base_model.working_copy()
+        self.steps_since_rebuild = 0
+
+        # Used to estimate how much time is saved by not replaying the window
+        self.batches_trained = 0
+        self.training_time = timedelta()
+        self.last_saved = timedelta()
+
+    def is_full(self):
+        """
+        return: boolean
+
+        Check if the window holds all past batches of a time frame.
+        """
+        return len(self.batches) >= self.time_frames - 1
+
+    def add_past_batch(self, batch):
+        """
+        batch: dict with a date and the comments of that batch
+
+        Add a batch to the window that is already trained in the current model,
+        e.g. when filling the window from the files of an earlier run. Returns
+        the batch that falls out of the window, or None. With a store, the
+        batch should be in the store and only its date is kept.
+        """
+        if self.store is not None:
+            batch = {'date': batch['date']}
+        self.batches.append(batch)
+        if len(self.batches) > self.time_frames - 1:
+            return self.batches.popleft()
+        return None
+
+    def restore(self, model, batches, steps_since_rebuild=0):
+        """
+        model: instance of the class Model, trained on the batches
+        batches: list of batches in the window, oldest first
+        steps_since_rebuild: steps done since the last rebuild
+
+        Continue with the window of an earlier run, e.g. from a checkpoint,
+        without replaying its batches.
+        """
+        self.model = model
+        if self.store is not None:
+            batches = [{'date': batch['date']} for batch in batches]
+        self.batches = deque(batches)
+        while len(self.batches) > self.time_frames - 1:
+            self.batches.popleft()
+        self.steps_since_rebuild = steps_since_rebuild
+
+    def rebuild(self):
+        """
+        return: number of batches replayed
+
+        Start again from the base model and train it on all batches that are
+        still in the window.
+        """
+        self.model = self.base_model.working_copy()
+        self.model.update(self.past_batches(), iterations=len(self.batches))
+        self.steps_since_rebuild = 0
+        return len(self.batches)
+
+    def past_batches(self):
+        """
+        yield: the batches in the window, oldest first. Read from the store one
+               at a time if there is one.
+        """
+        if self.appended is not None:
+            # Appends are done in order, so all batches are stored after this
+            self.appended.result()
+        for batch in list(self.batches):
+            if self.store is not None:
+                batch = self.store.read(batch['date'])
+            yield batch
+
+    def step(self, batch):
+        """
+        batch: dict with a date and the comments of that batch
+
+        return: tuple (replayed, expired). replayed is the number of batches
+                of the window that were trained again, expired is the batch
+                that fell out of the window or None. With a store, the new
+                batch is appended to it and the expired batch is only its
+                date.
+
+        Train the model of the window on a new batch. The model can be accessed
+        via self.model and the estimated time saved in this step via
+        self.last_saved.
+        """
+        # The old pipeline replayed the full window once it was filled
+        would_replay = len(self.batches) if self.is_full() else 0
+
+        replayed = 0
+        self.steps_since_rebuild += 1
+        if self.is_full() and self.steps_since_rebuild >= self.rebuild_every:
+            replayed = self.rebuild()
+
+        if self.store is not None:
+            # Convert to words once, for the store and for training
+            sentences = batch_sentences(batch)
+            if self.writer is not None:
+                self.appended = self.writer.submit(self.store.append, batch['date'], sentences)
+            else:
+                self.store.append(batch['date'], sentences)
+            batch = {'date': batch['date'], 'comments': sentences}
+
+        training_start = datetime.now()
+        self.model.update([batch])
+        self.training_time += datetime.now() - training_start
+        self.batches_trained += 1
+
+        self.last_saved = (self.training_time / self.batches_trained) * (would_replay - replayed)
+        return replayed, self.add_past_batch(batch)
@@ -0,0 +1,195 @@
+from datetime import datetime
+import gc
+import json
+import os
+import struct
+import threading
+import zlib
+from itertools import islice
+
+# First bytes of a batch file. After it come blocks of comments, every block
+# being its length in bytes followed by the compressed comments. Comments are
+# separated by newlines, words by spaces.
+MAGIC = b'UDW1'
+LENGTH = struct.Struct('<I')
+# Number of comments in one block
+BLOCK_SIZE = 10000
+
+class WindowStore:
+    """
+    Stores the batches of the window of the pipeline on disk, replacing the
+    json files in ../Database. Every batch is written once, compressed, to its
+    own file. A small index keeps the date, timestamp and file of every batch
+    in order, so batches can be read by time range and the oldest batch can
+    be removed without touching the others.
+
+    Batches are read back as a generator, one batch at a time, and the
+    comments of a batch are decompressed block by block.
+    """
+    def __init__(self, directory, level=1):
+        """
+        directory: folder of the store, created if it doesn't exist
+        level: zlib compression level, 1 is fastest
+        """
+        self.directory = directory
+        self.level = level
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # List of dicts with the date, timestamp, file and size of every
+        # batch, oldest first
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = []
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r') as inpt:
+                self.entries = json.load(inpt)
+
+    def save_index(self):
+        """
+        Write the index atomically. Call with the lock.
+        """
+        with open(self.index_path + '.tmp', 'w') as outpt:
+            json.dump(self.entries, outpt)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def dates(self):
+        """
+        return: list of the dates of all batches, oldest first
+        """
+        with self.lock:
+            return [entry['date'] for entry in self.entries]
+
+    def append(self, date, comments):
+        """
+        date: date of the batch, 'YYYY-MM-DD HH:MM' like create_batches
+        comments: iterable of comments. Comment being a list of words.
+
+        Write a batch. A batch with the same date is replaced.
+        """
+        fle = datetime.strptime(date, '%Y-%m-%d %H:%M').strftime('%Y%m%d%H%M') + '.batch'
+        path = os.path.join(self.directory, fle)
+        number = 0
+        comments = iter(comments)
+        with open(path + '.tmp', 'wb') as outpt:
+            outpt.write(MAGIC)
+            while True:
+                block = [' '.join(comment) for comment in islice(comments, BLOCK_SIZE)]
+                if len(block) == 0:
+                    break
+                number += len(block)
+                data = zlib.compress('\n'.join(block).encode('utf-8'), self.level)
+                outpt.write(LENGTH.pack(len(data)))
+                outpt.write(data)
+        os.replace(path + '.tmp', path)
+
+        entry = {'date': date, 'timestamp': timestamp(date), 'file': fle,
+                 'comments': number, 'bytes': os.path.getsize(path)}
+        with self.lock:
+            self.entries = [old for old in self.entries if old['date'] != date]
+            self.entries.append(entry)
+            self.entries.sort(key=lambda old: old['timestamp'])
+            self.save_index()
+
+    def remove(self, date):
+        """
+        date: date of a batch. Nothing happens if it is not in the store.
+
+        Remove a batch. Removing the oldest batch, like the window does, only
+        touches its own file and the index.
+        """
+        with self.lock:
+            if len(self.entries) > 0 and self.entries[0]['date'] == date:
+                entry = self.entries.pop(0)
+            else:
+                matches = [entry for entry in self.entries if entry['date'] == date]
+                if len(matches) == 0:
+                    return
+                entry = matches[0]
+                self.entries.remove(entry)
+            self.save_index()
+        try:
+            os.remove(os.path.join(self.directory, entry['file']))
+        except OSError:
+            pass
+
+    def retain(self, dates):
+        """
+        dates: dates of the batches to keep
+
+        Remove all other batches, e.g. the ones left by a run that was
+        stopped.
+        """
+        dates = set(dates)
+        for date in self.dates():
+            if date not in dates:
+                self.remove(date)
+
+    def comments(self, date):
+        """
+        date: date of a batch in the store
+
+        yield: the comments of the batch, every comment being a list of words
+        """
+        with self.lock:
+            fle = [entry['file'] for entry in self.entries if entry['date'] == date][0]
+
+        with open(os.path.join(self.directory, fle), 'rb') as inpt:
+            if inpt.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a batch of a window store'.format(fle))
+            while True:
+                header = inpt.read(LENGTH.size)
+                if len(header) < LENGTH.size:
+                    break
+                block = zlib.decompress(inpt.read(LENGTH.unpack(header)[0]))
+                for text in block.decode('utf-8').split('\n'):
+                    yield text.split(' ') if len(text) > 0 else []
+
+    def read(self, date):
+        """
+        date: date of a batch in the store
+
+        return: dict with the date and the comments of the batch, like the
+                batches of create_batches
+        """
+        # Making many small lists triggers the garbage collector over and over,
+        # while lists of words can't be part of a reference cycle
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return {'date': date, 'comments': list(self.comments(date))}
+        finally:
+            if enabled:
+                gc.enable()
+
+    def batches(self, start=None, end=None):
+        """
+        start: timestamp (seconds since epoch), only batches starting at or
+               after it. None for all.
+        end: timestamp, only batches starting before it. None for all.
+
+        yield: batches in order of time, read one at a time
+        """
+        with self.lock:
+            dates = [entry['date'] for entry in self.entries
+                     if (start is None or entry['timestamp'] >= start)
+                     and (end is None or entry['timestamp'] < end)]
+        for date in dates:
+            yield self.read(date)
+
+    def footprint(self):
+        """
+        return: dict with the number of batches, comments and bytes on disk
+        """
+        with self.lock:
+            return {'batches': len(self.entries),
+                    'comments': sum(entry['comments'] for entry in self.entries),
+                    'bytes': sum(entry['bytes'] for entry in self.entries)}
+
+def timestamp(date):
+    """
+    date: string 'YYYY-MM-DD HH:MM' in local time, like create_batches
+
+    return: seconds since epoch
+    """
+    return int(datetime.strptime(date, '%Y-%m-%d %H:%M').timestamp())
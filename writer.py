@@ -0,0 +1,164 @@
+from concurrent.futures import Future
+import json
+import os
+import queue
+import threading
+
+class BackgroundWriter:
+    """
+    Writes output (models, batches, urban dictionaries) in a background thread,
+    so the pipeline can continue with the next batch while the previous one is
+    written to disk.
+
+    Writes are done in the order they are submitted. The queue of writes is
+    bounded: when it is full, submitting waits until a write is done, so the
+    pipeline can't run too far ahead of the disk. If a write fails, the error
+    is raised on the next call to submit, flush or close.
+    """
+    def __init__(self, max_pending=4):
+        """
+        max_pending: maximum number of writes waiting in the queue
+        """
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        Loop of the background thread. Executes writes until None is received.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            future, function, args, kwargs = item
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as error:
+                if self.error is None:
+                    self.error = error
+                future.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """
+        Raise the error of a failed write, if any.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, function, *args, **kwargs):
+        """
+        function: function doing the write
+        *args, **kwargs: arguments passed to the function
+
+        return: concurrent.futures.Future of the write. Call result() on it to
+                wait for this write only.
+
+        Make sure the arguments are not changed until the write is done.
+        """
+        if self.closed:
+            raise ValueError('writer is closed')
+        self.check()
+        future = Future()
+        self.queue.put((future, function, args, kwargs))
+        return future
+
+    def save_model(self, model, dir_path):
+        """
+        model: instance of the class Model
+        dir_path: the folder where you want to save the model
+
+        return: Future of the write. The model can be read during the write,
+                but should not be trained before the write is done.
+        """
+        return self.submit(model.detached().save, dir_path)
+
+    def dump_json(self, obj, path, **kwargs):
+        """
+        obj: object to write as json
+        path: path of the output file
+        **kwargs are passed to json.dump
+
+        return: Future of the write
+        """
+        return self.submit(write_json, obj, path, **kwargs)
+
+    def remove(self, path):
+        """
+        path: file to remove. Nothing happens if it doesn't exist.
+
+        return: Future of the removal
+        """
+        return self.submit(remove_file, path)
+
+    def flush(self):
+        """
+        Wait until all submitted writes are done.
+        """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Wait until all submitted writes are done and stop the background
+        thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't hide the original error with an error of a write
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception:
+                pass
+
+def write_json(obj, path, **kwargs):
+    """
+    obj: object to write as json
+    path: path of the output file
+    **kwargs are passed to json.dump
+    """
+    with open(path, 'w') as outpt:
+        json.dump(obj, outpt, **kwargs)
+
+def publish_model(path, dir_path, wait_for=()):
+    """
+    path: pointer file, e.g. ../Models/latest
+    dir_path: folder of a completely saved model
+    wait_for: futures of the writes of the model. If one of them failed, the
+              model is not published and the error is raised.
+
+    Write the folder of the newest model to the pointer file atomically, so
+    readers like service.py never see a model that is still being saved.
+    """
+    for future in wait_for:
+        future.result()
+    with open(path + '.tmp', 'w') as outpt:
+        outpt.write(dir_path)
+    os.replace(path + '.tmp', path)
+
+def remove_file(path):
+    """
+    path: file to remove. Nothing happens if it doesn't exist.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass